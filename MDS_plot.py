@@ -4,14 +4,413 @@
 Data classification and dimensionality reduction.
 @author: Yu Che
 """
+import hashlib
+import json
+import os
+import pickle
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
+from collections import OrderedDict
 from datetime import datetime
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
 from sklearn import manifold
+from sklearn.decomposition import PCA
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import euclidean_distances
-from sklearn.cluster import AffinityPropagation
+from sklearn.metrics.pairwise import (pairwise_distances,
+                                      pairwise_distances_argmin,
+                                      pairwise_distances_chunked)
+from sklearn.neighbors import NearestNeighbors
+from sklearn.cluster import AffinityPropagation, Birch, MiniBatchKMeans
+
+
+def column_names(path, file_format):
+    """
+    Reading the column names of a data file without loading the data.
+
+    :param path: The path for input data file.
+    :param file_format: One of csv, xls, xlsx, parquet and feather.
+    :type path: str
+    :type file_format: str
+    :return: The column names, None for an unsupported format.
+    :rtype: list
+    """
+    if file_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    elif file_format in ('xls', 'xlsx'):
+        return list(pd.read_excel(path, nrows=0).columns)
+    elif file_format in ('parquet', 'feather'):
+        import pyarrow.ipc
+        import pyarrow.parquet
+        if file_format == 'parquet':
+            schema = pyarrow.parquet.read_schema(path)
+        else:
+            schema = pyarrow.ipc.open_file(path).schema
+        # Index columns stored by pandas are not data columns
+        index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+        return [name for name in schema.names if name not in index_columns]
+    return None
+
+
+def distance_matrix(features, dtype='float64', condensed=False, path=None):
+    """
+    Normalised Euclidean distance matrix computed in blocks of rows, so no
+    temporary matrix larger than one block is created.
+
+    :param features: The scaled feature matrix
+    :param dtype: The dtype of the distance matrix, float32 halves the memory
+    :param condensed: Only storing the upper triangle as a condensed vector
+    in the scipy.spatial.distance.squareform order
+    :param path: The path for a memory-mapped .npy file backing the matrix,
+    None for keeping it in memory
+    :type features: numpy.ndarray
+    :type dtype: str
+    :type condensed: bool
+    :type path: str
+    :return: The distance matrix divided by its maximum value
+    :rtype: numpy.ndarray
+    """
+    features = np.asarray(features, dtype=dtype)
+    n = len(features)
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if path is None:
+        distance = np.empty(shape, dtype=dtype)
+    else:
+        distance = np.lib.format.open_memmap(
+            path, mode='w+', dtype=dtype, shape=shape
+        )
+    start, offset = 0, 0
+    for block in pairwise_distances_chunked(features):
+        if condensed:
+            for row in range(len(block)):
+                i = start + row
+                distance[offset:offset + n - i - 1] = block[row, i + 1:]
+                offset += n - i - 1
+        else:
+            distance[start:start + len(block)] = block
+        start += len(block)
+    # In-place normalisation
+    maximum = distance.max() if len(distance) else 0
+    if maximum > 0:
+        np.divide(distance, maximum, out=distance)
+    return distance
+
+
+def similarity_edges(similarities, pos, range_line, shown=None,
+                     max_edges=None):
+    """
+    Line segments between all pairs of structures whose normalised distance
+    is inside range_line, built in one NumPy pass. Each pair is drawn once.
+
+    :param similarities: The square or condensed distance matrix
+    :param pos: The 2D coordinators of the structures
+    :param range_line: The range of length for similarity lines
+    :param shown: The mask of shown structures, None for all structures
+    :param max_edges: The cap of segments, subsampled above it
+    :type similarities: numpy.ndarray
+    :type pos: numpy.ndarray
+    :type range_line: tuple
+    :type shown: numpy.ndarray
+    :type max_edges: int
+    :return: The x and y coordinates of the segments, NaN separated
+    :rtype: tuple
+    """
+    n = len(pos)
+    if similarities.ndim == 1:
+        k = np.nonzero((similarities > range_line[0]) &
+                       (similarities < range_line[1]))[0]
+        # Row and column of each condensed index
+        i = n - 2 - np.floor(
+            np.sqrt(-8.0 * k + 4.0 * n * (n - 1) - 7) / 2 - 0.5
+        ).astype(np.int64)
+        j = k + i + 1 - n * (n - 1) // 2 + (n - i) * (n - i - 1) // 2
+    else:
+        # Upper triangle in blocks of rows, no n x n temporaries
+        rows, columns = [], []
+        block = max(1, 2 ** 22 // max(n, 1))
+        for start in range(0, n, block):
+            part = similarities[start:start + block]
+            mask = np.triu((part > range_line[0]) & (part < range_line[1]),
+                           k=start + 1)
+            i, j = np.nonzero(mask)
+            rows.append(i + start)
+            columns.append(j)
+        i = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        j = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+    if shown is not None:
+        both = shown[i] & shown[j]
+        i, j = i[both], j[both]
+    if max_edges is not None and len(i) > max_edges:
+        chosen = np.sort(np.random.RandomState(seed=0).choice(
+            len(i), max_edges, replace=False
+        ))
+        i, j = i[chosen], j[chosen]
+    # Start, stop and gap of each segment
+    edge_x = np.full(3 * len(i), np.nan)
+    edge_y = np.full(3 * len(i), np.nan)
+    edge_x[0::3], edge_x[1::3] = pos[i, 0], pos[j, 0]
+    edge_y[0::3], edge_y[1::3] = pos[i, 1], pos[j, 1]
+    return edge_x, edge_y
+
+
+def level_of_detail(pos, values, max_points):
+    """
+    Spatial binning of a 2D scatter for an overview. The plane is divided
+    into a square grid and the point with the lowest value is kept in each
+    occupied bin. The grid is refined while the occupied bins stay within
+    max_points, so dense clusters keep more detail.
+
+    :param pos: The 2D coordinators of the points
+    :param values: The values for choosing the point of each bin
+    :param max_points: The cap of kept points
+    :type pos: numpy.ndarray
+    :type values: numpy.ndarray
+    :type max_points: int
+    :return: The mask of kept points
+    :rtype: numpy.ndarray
+    """
+    low, high = pos.min(axis=0), pos.max(axis=0)
+    scaled = (pos - low) / np.where(high > low, high - low, 1)
+    order = np.argsort(values, kind='stable')
+    side, kept = max(1, int(np.sqrt(max_points))), None
+    while True:
+        cells = np.minimum((scaled * side).astype(np.int64), side - 1)
+        bins = (cells[:, 0] * side + cells[:, 1])[order]
+        _, first = np.unique(bins, return_index=True)
+        if kept is not None and len(first) > max_points:
+            break
+        kept = first
+        if len(first) == len(pos) or side > 2 ** 20:
+            break
+        side *= 2
+    shown = np.zeros(len(pos), dtype=bool)
+    shown[order[kept]] = True
+    return shown
+
+
+def feature_key(features):
+    """
+    Hash of a feature matrix, used to reuse results computed for the same
+    structures.
+
+    :param features: The feature matrix
+    :type features: numpy.ndarray
+    :return: The hex digest of the shape, dtype and values
+    :rtype: str
+    """
+    features = np.ascontiguousarray(features)
+    digest = hashlib.sha1('{}{}'.format(features.shape, features.dtype)
+                          .encode())
+    digest.update(features.data)
+    return digest.hexdigest()
+
+
+def locally_linear_embedding(features, graph, n_neighbors, seed,
+                             max_iter=100, reg=1e-3, batch_size=10000):
+    """
+    Standard locally linear embedding from a precomputed neighbour graph,
+    as same as sklearn.manifold.locally_linear_embedding without searching
+    the neighbours again. The barycenter weights are solved in batches.
+
+    :param features: The scaled feature matrix
+    :param graph: The sparse distance graph with each structure as its own
+    nearest neighbour and at least n_neighbors other neighbours per row
+    :param n_neighbors: The number of neighbours of each structure
+    :param seed: The random state of the eigen solver
+    :param max_iter: The maximum number of ARPACK iterations
+    :param reg: The regularisation of the local Gram matrices
+    :param batch_size: The number of structures in each batch
+    :type features: numpy.ndarray
+    :type graph: scipy.sparse.csr_matrix
+    :type n_neighbors: int
+    :type seed: numpy.random.RandomState
+    :type max_iter: int
+    :type reg: float
+    :type batch_size: int
+    :return: The 2D coordinators
+    :rtype: numpy.ndarray
+    """
+    n = len(features)
+    if n_neighbors >= n:
+        raise ValueError(
+            'Expected n_neighbors < n_samples, but n_samples = {}, '
+            'n_neighbors = {}'.format(n, n_neighbors)
+        )
+    # Neighbours sorted by distance, the first one is the structure itself
+    width = np.diff(graph.indptr)[0]
+    order = np.argsort(graph.data.reshape(n, width), axis=1, kind='stable')
+    index = np.take_along_axis(
+        graph.indices.reshape(n, width), order, axis=1
+    )[:, 1:n_neighbors + 1]
+    weights = np.empty((n, n_neighbors))
+    for i in range(0, n, batch_size):
+        local = features[index[i:i + batch_size]] - \
+            features[i:i + batch_size, None, :]
+        gram = local @ local.transpose(0, 2, 1)
+        trace = np.trace(gram, axis1=1, axis2=2)
+        gram[:, np.arange(n_neighbors), np.arange(n_neighbors)] += \
+            np.where(trace > 0, reg * trace, reg)[:, None]
+        w = np.linalg.solve(gram, np.ones((len(gram), n_neighbors, 1)))[..., 0]
+        weights[i:i + batch_size] = w / w.sum(axis=1)[:, None]
+    w = sparse.csr_matrix((
+        weights.ravel(), index.ravel(),
+        np.arange(0, n * n_neighbors + 1, n_neighbors)
+    ), shape=(n, n))
+    # M = (I - W)' (I - W), its bottom eigenvectors without the constant
+    m = sparse.identity(n, format='csr') - w
+    m = (m.T @ m).tocsr()
+    if n > 200:
+        values, vectors = eigsh(
+            m, 3, sigma=0.0, tol=1e-6, maxiter=max_iter,
+            v0=seed.uniform(-1, 1, n)
+        )
+        values = np.abs(values)
+    else:
+        values, vectors = np.linalg.eigh(m.toarray())
+    return vectors[:, np.argsort(values)[1:3]]
+
+
+class LandmarkEmbedding(object):
+    """
+    Two dimensional embedding of landmark structures with out-of-sample
+    placement of other structures.\n
+    Landmark MDS embeds the landmarks with classical MDS and places a
+    structure from its squared distances to the landmarks, Isomap and LLE
+    use their transform function and t-SNE uses the distance weighted mean
+    of the nearest landmarks. The fitted model is pickled by save() so new
+    structures can be placed without fitting again.
+    """
+    def __init__(self, method, columns, scaler, n_neighbors=12):
+        """
+        :param method: One of 'mds', 'tsne', 'isomap' and 'lle'
+        :param columns: The feature column names
+        :param scaler: The fitted scaler of the features
+        :param n_neighbors: The number of neighbours for Isomap, LLE and
+        the t-SNE placement
+        :type method: str
+        :type columns: list
+        :type scaler: MinMaxScaler
+        :type n_neighbors: int
+        """
+        self.method = method
+        self.columns = columns
+        self.scaler = scaler
+        self.n_neighbors = n_neighbors
+        self.landmarks = None
+        self.positions = None
+        self.scale = None
+        self.estimator = None
+        # Landmark MDS terms
+        self.center = None
+        self.pseudo_inverse = None
+        self.mean_square = None
+
+    def fit(self, landmarks, seed):
+        """
+        Embedding the landmarks.
+
+        :param landmarks: The scaled features of the landmarks
+        :param seed: The random state
+        :type landmarks: numpy.ndarray
+        :type seed: numpy.random.RandomState
+        :return: The positions of the landmarks
+        :rtype: numpy.ndarray
+        """
+        self.landmarks = landmarks
+        distance = pairwise_distances(landmarks)
+        self.scale = distance.max() or 1.0
+        distance /= self.scale
+        if self.method == 'mds':
+            # Classical MDS, so the landmark triangulation is exact
+            square = distance ** 2
+            center = square - square.mean(axis=0)
+            center -= center.mean(axis=1)[:, None]
+            values, vectors = np.linalg.eigh(-0.5 * center)
+            values = np.maximum(values[::-1][:2], 1e-12)
+            vectors = vectors[:, ::-1][:, :2]
+            self.positions = vectors * np.sqrt(values)
+            self.center = self.positions.mean(axis=0)
+            self.pseudo_inverse = (vectors / np.sqrt(values)).T
+            self.mean_square = square.mean(axis=0)
+        elif self.method == 'tsne':
+            self.positions = manifold.TSNE(
+                n_components=2, max_iter=30000, random_state=seed,
+                min_grad_norm=1e-12, init='pca'
+            ).fit(landmarks).embedding_
+            self.estimator = NearestNeighbors(
+                n_neighbors=min(self.n_neighbors, len(landmarks))
+            ).fit(landmarks)
+        elif self.method == 'isomap':
+            self.estimator = manifold.Isomap(
+                n_components=2, n_neighbors=self.n_neighbors,
+                max_iter=30000,
+            )
+            self.positions = self.estimator.fit(landmarks).embedding_
+        elif self.method == 'lle':
+            self.estimator = manifold.LocallyLinearEmbedding(
+                n_neighbors=self.n_neighbors, n_components=2,
+                max_iter=30000, random_state=seed
+            )
+            self.positions = self.estimator.fit(landmarks).embedding_
+        return self.positions
+
+    def transform(self, features, batch_size=10000):
+        """
+        Placing structures into the fitted embedding in batches.
+
+        :param features: The scaled features of the structures
+        :param batch_size: The number of structures in each batch
+        :type features: numpy.ndarray
+        :type batch_size: int
+        :return: The positions of the structures
+        :rtype: numpy.ndarray
+        """
+        pos = np.empty((len(features), 2))
+        for i in range(0, len(features), batch_size):
+            batch = features[i:i + batch_size]
+            if self.method == 'mds':
+                square = (
+                    pairwise_distances(batch, self.landmarks) / self.scale
+                ) ** 2
+                pos[i:i + batch_size] = (
+                    -0.5 * (square - self.mean_square) @
+                    self.pseudo_inverse.T + self.center
+                )
+            elif self.method == 'tsne':
+                distance, index = self.estimator.kneighbors(batch)
+                weights = 1 / np.maximum(distance, 1e-12)
+                pos[i:i + batch_size] = np.einsum(
+                    'ij,ijk->ik', weights / weights.sum(axis=1)[:, None],
+                    self.positions[index]
+                )
+            else:
+                pos[i:i + batch_size] = self.estimator.transform(batch)
+        return pos
+
+    def save(self, path):
+        """
+        Pickling the fitted model.
+
+        :param path: The file path
+        :type path: str
+        :return: None
+        """
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        """
+        Loading a pickled model.
+
+        :param path: The file path
+        :type path: str
+        :return: The fitted model
+        :rtype: LandmarkEmbedding
+        """
+        with open(path, 'rb') as file:
+            return pickle.load(file)
 
 
 # noinspection PyRedundantParentheses,PyUnboundLocalVariable
@@ -25,48 +424,149 @@ class MdsPlot(object):
         self.data_df = pd.DataFrame()
         self.selected_df = pd.DataFrame()
         self.similarities = None
+        # Arguments of distance_matrix and the key of self.similarities
+        self.distance_args = None
+        self.distance_key = None
         self.features = None
         self.size = None
         self.pos_df = pd.DataFrame()
+        self.embedding = None
+        # Shared neighbour search for t-SNE, Isomap and LLE
+        self.n_neighbors = 12
+        self.perplexity = 30.0
+        self.angle = 0.5
+        self.n_jobs = None
+        self.algorithm = 'auto'
+        self.neighbors = None
+        # Embedding cache, see setup_cache
+        self.embedding_cache = OrderedDict()
+        self.cache_size = 8
+        self.cache_folder = None
+
+    def setup_embedding(self, n_neighbors=12, perplexity=30.0, angle=0.5,
+                        n_jobs=None, algorithm='auto'):
+        """
+        Setting up the neighbour search and the t-SNE Barnes-Hut
+        parameters of dim_reduction_calculation.
+
+        :param n_neighbors: The number of neighbours for Isomap and LLE,
+        also used by the landmark embedding
+        :param perplexity: The t-SNE perplexity, 3 * perplexity + 1
+        neighbours are searched for t-SNE
+        :param angle: The Barnes-Hut angle of t-SNE, larger is faster and
+        less accurate
+        :param n_jobs: The number of parallel jobs, None for 1 and -1 for all
+        CPU cores
+        :param algorithm: The neighbour search tree, 'ball_tree', 'kd_tree',
+        'brute' or 'auto'
+        :type n_neighbors: int
+        :type perplexity: float
+        :type angle: float
+        :type n_jobs: int
+        :type algorithm: str
+        :return: None
+        """
+        self.n_neighbors = n_neighbors
+        self.perplexity = perplexity
+        self.angle = angle
+        self.n_jobs = n_jobs
+        self.algorithm = algorithm
+        self.neighbors = None
+
+    def setup_cache(self, size=8, folder=None):
+        """
+        Setting up the embedding cache of dim_reduction_calculation.
+        Embeddings are keyed by a hash of the scaled features, the method
+        and its parameters, so switching back to a method returns the
+        previous result without fitting again.
+
+        :param size: The number of embeddings kept in memory, 0 for
+        disabling the memory cache
+        :param folder: The folder for persisting embeddings as .npy files,
+        None for memory only
+        :type size: int
+        :type folder: str
+        :return: None
+        """
+        self.cache_size = size
+        self.cache_folder = folder
+        if folder is not None and not os.path.exists(folder):
+            os.makedirs(folder)
+        while len(self.embedding_cache) > size:
+            self.embedding_cache.popitem(last=False)
 
-    def data_retrieve(self, path, size, descriptors):
+    def data_retrieve(self, path, size, descriptors, dtype='float64',
+                      chunk_size=100000):
         """
-        Data set retrieve function.
+        Data set retrieve function.\n
+        Only the columns in the size range and the descriptors are read from
+        the file. The floating point columns in the range are selected in one
+        step as features and cast to dtype, the descriptors keep their
+        dtype. CSV files are read in chunks and the features of each chunk
+        are cast before joining, so the peak memory stays close to the size
+        of the feature matrix.
 
-        :param path: The path for input data file.
+        :param path: The path for input data file. Supported csv, xls, xlsx,
+        pkl, parquet and feather.
         :param size: The range of columns in data set.
         :param descriptors: Variables will be used in the plot.
+        :param dtype: The dtype of features, float32 halves the memory.
+        :param chunk_size: The number of rows in each chunk of a CSV file.
         :type path: str
         :type size: tuple
         :type descriptors: list
+        :type dtype: str
+        :type chunk_size: int
         :return: None
         """
         print('Reading data frame...')
         self.size = size
-        # Reading data frame
+        # Reading the column names only
         file_format = path.split('.')[-1]
-        if file_format == 'csv':
-            self.df = pd.read_csv(path)
-        elif file_format == ('xls' or 'xlsx'):
-            self.df = pd.read_excel(path)
-        elif file_format == 'pkl':
+        if file_format == 'pkl':
             self.df = pd.read_pickle(path)
+            names = list(self.df.columns)
         else:
+            names = column_names(path, file_format)
+        if names is None:
             print('Error! Please select the correct format file.')
             exit()
-        # Selecting the range of input data
-        self.data_df = self.df.iloc[:, size[0]:size[1]]
-        # Delete no numerical data to avoid error in normalization
-        for column in self.data_df.columns:
-            if self.data_df.dtypes[column] != ('float64' or 'int64'):
-                self.data_df = self.data_df.drop(column, axis=1)
+        # Selecting the range of input data and the descriptors
+        range_columns = names[size[0]:size[1]]
+        columns = range_columns + [
+            name for name in descriptors if name not in range_columns
+        ]
+        if file_format == 'csv':
+            chunks = pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+            self.df = pd.concat(
+                [chunk.astype({
+                    column: dtype for column in
+                    chunk[range_columns].select_dtypes(
+                        include='floating'
+                    ).columns
+                }) for chunk in chunks], ignore_index=True
+            )
+        elif file_format in ('xls', 'xlsx'):
+            self.df = pd.read_excel(path, usecols=columns)
+        elif file_format == 'pkl':
+            self.df = self.df[columns]
+        elif file_format == 'parquet':
+            self.df = pd.read_parquet(path, columns=columns)
+        else:
+            self.df = pd.read_feather(path, columns=columns)
+        # Only float columns as features to avoid error in normalization
+        features = self.df[range_columns].select_dtypes(
+            include='floating'
+        ).astype(dtype)
+        # Merge descriptors into data_df
+        self.data_df = pd.concat(
+            [features, self.df[[name for name in descriptors
+                                if name not in features.columns]]], axis=1
+        )
         print('Normalizing...')
         # Normalization
-        self.features = MinMaxScaler().fit_transform(self.data_df.values)
-        # Merge descriptors into data_df
-        self.data_df = self.data_df.merge(
-            pd.DataFrame(self.df[descriptors]), left_index=True,
-            right_index=True
+        self.features = MinMaxScaler(copy=False).fit_transform(
+            features.to_numpy(dtype=dtype)
         )
         print(
             'Finished!\n'
@@ -75,99 +575,225 @@ class MdsPlot(object):
             'Descriptor shape:    {}'.format(self.features.shape)
         )
 
-    def affinity_propagation_cluster(self):
+    def affinity_propagation_cluster(self, engine='affinity',
+                                     n_clusters=None, landmarks=5000,
+                                     batch_size=10000, threshold=0.1):
         """
-        Using affinity propagation to cluster the data set. The cluster
-        information is written in the 'AffinityPropagation' column.
+        Clustering the data set. The cluster information is written in the
+        'AffinityPropagation' column for all engines.\n
+        'affinity' runs affinity propagation on all structures, which needs
+        O(n^2) memory. 'landmark' runs affinity propagation on a random
+        subset of landmarks and assigns every structure to its nearest
+        exemplar. 'minibatch' (MiniBatchKMeans) and 'birch' scale to
+        millions of structures.
 
+        :param engine: One of 'affinity', 'landmark', 'minibatch' and 'birch'
+        :param n_clusters: The number of clusters, required for 'minibatch'
+        and optional for 'birch'
+        :param landmarks: The number of landmarks for 'landmark'
+        :param batch_size: The mini batch size for 'minibatch'
+        :param threshold: The subcluster radius for 'birch', the features are
+        scaled into [0, 1]
+        :type engine: str
+        :type n_clusters: int
+        :type landmarks: int
+        :type batch_size: int
+        :type threshold: float
         :return: None
         """
-        print('Affinity propagation starting...')
+        print('Clustering starting...')
         start = datetime.now()
-        af = AffinityPropagation(
-            max_iter=30000, convergence_iter=70, preference=None
-        ).fit(self.features)
-        cluster_centers_indices = af.cluster_centers_indices_
-        df_labels = pd.DataFrame(af.labels_)
-        n_clusters = len(cluster_centers_indices)
-        # Merge cluster information into origin data frame
-        self.data_df = self.data_df.merge(
-            df_labels, left_index=True, right_index=True
-        )
-        self.data_df.rename(columns={0: 'AffinityPropagation'}, inplace=True)
+        if engine == 'affinity':
+            labels = AffinityPropagation(
+                max_iter=30000, convergence_iter=70, preference=None
+            ).fit(self.features).labels_
+        elif engine == 'landmark':
+            seed = np.random.RandomState(seed=0)
+            n_samples = len(self.features)
+            sample = np.sort(seed.choice(
+                n_samples, min(landmarks, n_samples), replace=False
+            ))
+            af = AffinityPropagation(
+                max_iter=30000, convergence_iter=70, preference=None,
+                random_state=0
+            ).fit(self.features[sample])
+            if len(af.cluster_centers_indices_) == 0:
+                print('Error! Affinity propagation did not converge.')
+                return
+            # Nearest exemplar for all structures, computed in blocks
+            labels = pairwise_distances_argmin(
+                self.features, af.cluster_centers_
+            )
+        elif engine == 'minibatch':
+            if n_clusters is None:
+                print('Error! The minibatch engine needs n_clusters.')
+                return
+            labels = MiniBatchKMeans(
+                n_clusters=n_clusters, batch_size=batch_size, n_init=3,
+                random_state=0
+            ).fit(self.features).labels_
+        elif engine == 'birch':
+            labels = Birch(
+                n_clusters=n_clusters, threshold=threshold
+            ).fit(self.features).labels_
+        else:
+            print('Error! Engine must be affinity, landmark, minibatch or '
+                  'birch.')
+            return
+        # Write cluster information into the data frame
+        self.data_df['AffinityPropagation'] = labels
         print(
             'Finished!\n'
             'Estimated number of clusters: {}\n'
-            'Total time:{}'.format(n_clusters, (datetime.now() - start))
+            'Total time:{}'.format(len(np.unique(labels)),
+                                   (datetime.now() - start))
         )
 
-    def cluster_structure_selection(self, descriptor):
+    def cluster_structure_selection(self, descriptor, top_k=1, keep='all'):
         """
-        Choosing the lowest value for selected descriptor in each cluster.
+        Choosing the lowest values for selected descriptor in each cluster.
+        All clusters are ranked in one groupby pass and the selected
+        structures are ordered by cluster.
 
         :param descriptor: One selected variable in the data frame.
+        :param top_k: The number of lowest values chosen in each cluster.
+        :param keep: 'all' for keeping all tied structures, 'first' for
+        exactly top_k structures in each cluster.
         :type descriptor: str
+        :type top_k: int
+        :type keep: str
         :return: None
         """
+        if keep not in ['all', 'first']:
+            print('Error! Keep must be all or first.')
+            return
+        clustered = self.data_df[self.data_df['AffinityPropagation'] >= 0]
         # The lowest lattice energy for each cluster
-        for i in range(0, self.data_df.AffinityPropagation.max() + 1):
-            df_cluster = self.data_df[self.data_df['AffinityPropagation'] == i]
-            selected_structure = df_cluster[
-                df_cluster[descriptor] == df_cluster[descriptor].min()
-                ]
-            self.selected_df = self.selected_df.append(selected_structure)
+        rank = clustered.groupby('AffinityPropagation')[descriptor].rank(
+            method='min' if keep == 'all' else 'first'
+        )
+        self.selected_df = clustered[rank <= top_k].sort_values(
+            'AffinityPropagation', kind='stable'
+        )
         # Rearrange index
         self.selected_df.index = range(len(self.selected_df))
 
-    def dim_reduction_calculation(self, method):
+    def dim_reduction_calculation(self, method, dtype='float64',
+                                  memmap=None, landmarks=None):
         """
         Using non-linear dimensionality reduction method for the selected data
         to calculate 2D coordinators.
         The coordinator information is written in 'pos0' and 'pos1' columns.
+        The normalised distances are computed in blocks. MDS needs the square
+        matrix, the other methods only store the condensed upper triangle.\n
+        With landmarks, only a random subset of structures is embedded and
+        the others are placed by self.embedding, which can place new
+        structures later, see place_structures. The distance matrix is not
+        computed in this mode. Only MDS needs the distance matrix, for the
+        other methods and cached embeddings it is computed when plot draws
+        the similarity lines.
 
         :param method: The chosen method for reduction. Supported MDS, t-SNE,
         isomap and lle.
+        :param dtype: The dtype of the distance matrix
+        :param memmap: The path for a .npy file backing the distance matrix,
+        None for keeping it in memory
+        :param landmarks: The number of landmarks, None for embedding all
+        structures
         :type method: str
+        :type dtype: str
+        :type memmap: str
+        :type landmarks: int
         :return: None
         """
-        print('Distance calculation...')
         start = datetime.now()
         # Selecting the data matrix
-        features = self.selected_df.iloc[
-                   :, self.size[0]:(self.size[1] - 1)].values
-        scaled_features = MinMaxScaler().fit_transform(features)
-        # Distance calculation
-        distance = euclidean_distances(scaled_features)
-        self.similarities = distance / distance.max()
-        print('Dimensionality reduction starting...')
+        columns = self.selected_df.columns[self.size[0]:(self.size[1] - 1)]
+        scaler = MinMaxScaler()
+        scaled_features = scaler.fit_transform(
+            self.selected_df[columns].values
+        )
         seed = np.random.RandomState(seed=0)
-        if method == 'mds':
-            mds = manifold.MDS(
-                n_components=2, max_iter=30000, random_state=seed,
-                eps=1e-12, dissimilarity="precomputed"
-            )
-            pos = mds.fit(self.similarities).embedding_
-        elif method == 'tsne':
-            tsne = manifold.TSNE(
-                n_components=2, n_iter=30000, random_state=seed,
-                min_grad_norm=1e-12, init='pca'
+        key = self._embedding_key(scaled_features, method, dtype, landmarks)
+        cached = self._cached_embedding(key)
+        if landmarks is not None:
+            self.similarities, self.distance_args = None, None
+        else:
+            self.distance_args = (
+                scaled_features, dtype, method != 'mds', memmap
             )
-            pos = tsne.fit(scaled_features).embedding_
-        elif method == 'isomap':
-            isomap = manifold.Isomap(
-                n_components=2, n_neighbors=12, max_iter=30000,
+            if cached is None and method == 'mds':
+                self._distances()
+            elif self._distance_key() != self.distance_key:
+                # Computed by plot when the similarity lines are drawn
+                self.similarities = None
+        if cached is not None:
+            print('Embedding found in the cache.')
+            pos, embedding = cached
+            if landmarks is not None:
+                self.embedding = embedding
+        elif landmarks is not None:
+            print('Landmark embedding starting...')
+            n_samples = len(scaled_features)
+            index = np.sort(seed.choice(
+                n_samples, min(landmarks, n_samples), replace=False
+            ))
+            self.embedding = LandmarkEmbedding(
+                method, list(columns), scaler, self.n_neighbors
             )
-            pos = isomap.fit(scaled_features).embedding_
-        elif method == 'lle':
-            lle = manifold.locally_linear_embedding(
-                X=scaled_features, n_neighbors=12,
-                n_components=2, max_iter=30000, random_state=seed
+            landmark_pos = self.embedding.fit(scaled_features[index], seed)
+            pos = self.embedding.transform(scaled_features)
+            pos[index] = landmark_pos
+        else:
+            print('Dimensionality reduction starting...')
+            if method in ['tsne', 'isomap', 'lle']:
+                _, graph = self._neighbor_graph(scaled_features)
+            if method == 'mds':
+                mds = manifold.MDS(
+                    n_components=2, max_iter=30000, random_state=seed,
+                    eps=1e-12, dissimilarity="precomputed"
+                )
+                pos = mds.fit(self.similarities).embedding_
+            elif method == 'tsne':
+                # PCA initialisation of init='pca', which is not allowed
+                # with the precomputed metric
+                init = PCA(
+                    n_components=2, random_state=seed
+                ).fit_transform(scaled_features).astype(np.float32)
+                init = init / np.std(init[:, 0]) * 1e-4
+                tsne = manifold.TSNE(
+                    n_components=2, max_iter=30000, random_state=seed,
+                    min_grad_norm=1e-12, init=init, metric='precomputed',
+                    perplexity=self.perplexity, angle=self.angle,
+                    n_jobs=self.n_jobs
+                )
+                pos = tsne.fit(graph).embedding_
+            elif method == 'isomap':
+                isomap = manifold.Isomap(
+                    n_components=2, n_neighbors=self.n_neighbors,
+                    max_iter=30000, metric='precomputed', n_jobs=self.n_jobs
+                )
+                try:
+                    pos = isomap.fit(graph).embedding_
+                except RuntimeError:
+                    # Disconnected graph is completed from the features
+                    print('Warning! The neighbour graph is disconnected.')
+                    isomap.set_params(metric='minkowski')
+                    pos = isomap.fit(scaled_features).embedding_
+            elif method == 'lle':
+                pos = locally_linear_embedding(
+                    scaled_features, graph, self.n_neighbors, seed,
+                    max_iter=30000
+                )
+        if cached is None:
+            self._store_embedding(
+                key, pos, self.embedding if landmarks is not None else None
             )
-            pos = lle[0]
         self.pos_df = pd.DataFrame(data=pos, columns=['pos0', 'pos1'])
-        self.selected_df = self.selected_df.merge(
-            self.pos_df, left_index=True, right_index=True
-        )
+        # Replacing the coordinators of the previous method
+        self.selected_df = self.selected_df.drop(
+            columns=['pos0', 'pos1'], errors='ignore'
+        ).merge(self.pos_df, left_index=True, right_index=True)
         print(
             'Finished.\n'
             'Distance matrix:     self.similarities\n'
@@ -175,12 +801,176 @@ class MdsPlot(object):
             'Total time:{}'.format(datetime.now() - start)
         )
 
+    def _embedding_key(self, features, method, dtype, landmarks):
+        """
+        Cache key of an embedding from the scaled features, the method and
+        all parameters which change the result.
+
+        :return: The hex digest
+        :rtype: str
+        """
+        params = [method, landmarks]
+        if method == 'mds':
+            params.append(str(np.dtype(dtype)))
+        elif landmarks is None:
+            params += [self.n_neighbors, self.perplexity, self.angle]
+        else:
+            params.append(self.n_neighbors)
+        return hashlib.sha1(
+            (feature_key(features) + json.dumps(params)).encode()
+        ).hexdigest()
+
+    def _distance_key(self):
+        """
+        Key of the distance matrix for self.distance_args.
+
+        :return: The hex digest
+        :rtype: str
+        """
+        features, dtype, condensed, path = self.distance_args
+        return hashlib.sha1((feature_key(features) + json.dumps(
+            [str(np.dtype(dtype)), condensed, path]
+        )).encode()).hexdigest()
+
+    def _distances(self):
+        """
+        Computing self.similarities for self.distance_args, the matrix is
+        reused if the features and the arguments are unchanged.
+
+        :return: The distance matrix
+        :rtype: numpy.ndarray
+        """
+        key = self._distance_key()
+        if self.similarities is None or key != self.distance_key:
+            print('Distance calculation...')
+            self.similarities = distance_matrix(*self.distance_args)
+            self.distance_key = key
+        return self.similarities
+
+    def _cached_embedding(self, key):
+        """
+        Looking up an embedding in memory, then in self.cache_folder.
+
+        :param key: The cache key
+        :type key: str
+        :return: The positions and the landmark embedding, None if missing
+        :rtype: tuple
+        """
+        if key in self.embedding_cache:
+            self.embedding_cache.move_to_end(key)
+            pos, embedding = self.embedding_cache[key]
+            return pos.copy(), embedding
+        if self.cache_folder is None:
+            return None
+        path = os.path.join(self.cache_folder, key)
+        if not os.path.exists(path + '.npy'):
+            return None
+        pos, embedding = np.load(path + '.npy'), None
+        if os.path.exists(path + '.pkl'):
+            embedding = LandmarkEmbedding.load(path + '.pkl')
+        self._store_embedding(key, pos, embedding, persist=False)
+        return pos.copy(), embedding
+
+    def _store_embedding(self, key, pos, embedding=None, persist=True):
+        """
+        Storing an embedding, the least recently used embeddings above
+        self.cache_size are evicted from memory.
+
+        :param key: The cache key
+        :param pos: The positions
+        :param embedding: The landmark embedding
+        :param persist: Also saving into self.cache_folder
+        :type key: str
+        :type pos: numpy.ndarray
+        :type embedding: LandmarkEmbedding
+        :type persist: bool
+        :return: None
+        """
+        self.embedding_cache[key] = (pos.copy(), embedding)
+        self.embedding_cache.move_to_end(key)
+        while len(self.embedding_cache) > self.cache_size:
+            self.embedding_cache.popitem(last=False)
+        if persist and self.cache_folder is not None:
+            path = os.path.join(self.cache_folder, key)
+            np.save(path + '.npy', pos)
+            if embedding is not None:
+                embedding.save(path + '.pkl')
+
+    def _neighbor_graph(self, features):
+        """
+        Searching the nearest neighbours once for t-SNE, Isomap and LLE.
+        The search tree and the neighbour graph are reused until the
+        features or the setup change.
+
+        :param features: The scaled features of the selected structures
+        :type features: numpy.ndarray
+        :return: The fitted NearestNeighbors and the sparse distance graph
+        :rtype: tuple
+        """
+        n_neighbors = min(len(features) - 1, max(
+            self.n_neighbors, int(3 * self.perplexity + 1)
+        ))
+        key = (feature_key(features), n_neighbors, self.algorithm)
+        if self.neighbors is None or self.neighbors[0] != key:
+            print('Neighbour search...')
+            index = NearestNeighbors(
+                n_neighbors=n_neighbors + 1, algorithm=self.algorithm,
+                n_jobs=self.n_jobs
+            ).fit(features)
+            # Each structure is its own neighbour with an explicit zero
+            graph = index.kneighbors_graph(features, mode='distance')
+            self.neighbors = (key, index, graph)
+        return self.neighbors[1], self.neighbors[2]
+
+    def place_structures(self, df):
+        """
+        Placing new structures into the landmark embedding of the last
+        dim_reduction_calculation or load_embedding without fitting again.
+
+        :param df: The data frame of new structures with the feature columns
+        :type df: pandas.DataFrame
+        :return: A copy of df with the 'pos0' and 'pos1' columns
+        :rtype: pandas.DataFrame
+        """
+        if self.embedding is None:
+            print('Error! No landmark embedding is fitted or loaded.')
+            return None
+        features = self.embedding.scaler.transform(
+            df[self.embedding.columns].values
+        )
+        pos = self.embedding.transform(features)
+        return df.assign(pos0=pos[:, 0], pos1=pos[:, 1])
+
+    def save_embedding(self, path):
+        """
+        Saving the landmark embedding model.
+
+        :param path: The file path
+        :type path: str
+        :return: None
+        """
+        self.embedding.save(path)
+
+    def load_embedding(self, path):
+        """
+        Loading a landmark embedding model saved by save_embedding.
+
+        :param path: The file path
+        :type path: str
+        :return: None
+        """
+        self.embedding = LandmarkEmbedding.load(path)
+
     def plot(self, title, size, color, tag=(), range_line=(),
-             colorscale='RdBu', lines=False, text='Structure'):
+             colorscale='RdBu', lines=False, text='Structure', webgl=False,
+             max_points=None, max_edges=None):
         """
         This function is based on plotly API to generate a scatter plot for
         non-linear dimensionality reduction.
-        Using plotly function to generate the plot in notebook.
+        Using plotly function to generate the plot in notebook.\n
+        For large data sets, webgl draws all points as one Scattergl trace
+        with per-point symbols and max_points and max_edges limit the
+        overview to a level of detail. Tagged structures are always shown.
 
         :param title: The plot title.
         :param text:  The descriptor will be shown in the text part in plot.
@@ -190,89 +980,120 @@ class MdsPlot(object):
         :param tag: The name of selected structures shown in diamond style.
         :param range_line: The range of length for similarity lines
         :param colorscale: Sets the colorscale
+        :param webgl: Rendering with WebGL in a single trace.
+        :param max_points: The cap of shown points, the plane is divided into
+        max_points bins and the point with the lowest colour value is shown
+        in each bin. None for all points.
+        :param max_edges: The cap of shown similarity lines, lines are
+        subsampled above it. None for all lines.
         :type title: str
         :type size: str
         :type color: str
         :type tag: tuple
         :type range_line: tuple
         :type colorscale: str or list
+        :type webgl: bool
+        :type max_points: int
+        :type max_edges: int
         :return: Plotly figure object.
         """
         print('Starting...')
         start = datetime.now()
-        tag_list = list(
-            self.selected_df[self.selected_df.Structure.isin(list(tag))].index
-        )
+        tagged = self.selected_df.Structure.isin(list(tag)).values
+        shown = np.ones(len(self.selected_df), dtype=bool)
+        if max_points is not None and len(shown) > max_points:
+            shown = level_of_detail(
+                self.pos_df.values, self.selected_df[color].values, max_points
+            ) | tagged
+            print('Level of detail:    {} of {} points'.format(
+                shown.sum(), len(shown)
+            ))
+        df = self.selected_df[shown]
+        tag_list = list(np.nonzero(tagged[shown])[0])
+        scatter = go.Scattergl if webgl else go.Scatter
         # Generating the network line part
+        if lines and self.distance_args is None:
+            print('Warning! No distance matrix in landmark mode, lines are '
+                  'skipped.')
+            lines = False
         if lines:
             print('Building the line segment...')
-            edge_trace = go.Scatter(
-                x=[],
-                y=[],
+            self._distances()
+            edge_x, edge_y = similarity_edges(
+                self.similarities, self.pos_df.values, range_line, shown,
+                max_edges
+            )
+            edge_trace = scatter(
+                x=edge_x,
+                y=edge_y,
                 line=dict(width=0.5, color='rgb(134, 134, 134)'),
                 opacity=0.7,
                 hoverinfo='none',
                 mode='lines'
             )
-            # Generate the start-stop point coordinates
-            segments = []
-            n_space = len(self.similarities)
-            for i in range(n_space):
-                for j in range(n_space):
-                    # Limited the line length
-                    if range_line[0] < self.similarities[i, j] < range_line[1]:
-                        p1 = [self.pos_df.iloc[i, 0], self.pos_df.iloc[i, 1]]
-                        p2 = [self.pos_df.iloc[j, 0], self.pos_df.iloc[j, 1]]
-                        segments.append([p1, p2])
-            # Adding each line's coordinates into plot
-            for edge in segments:
-                x0, y0 = edge[0]
-                x1, y1 = edge[1]
-                edge_trace['x'] += tuple([x0, x1, None])
-                edge_trace['y'] += tuple([y0, y1, None])
         # Scatter plot
         print('Building the scatter segment...')
-        # Circle points and hiding the selected points
-        trace0 = go.Scatter(
-            x=self.selected_df.loc[:, 'pos0'],
-            y=self.selected_df.loc[:, 'pos1'],
-            text=self.selected_df.loc[:, text],
-            mode='markers',
-            selectedpoints=tag_list,
-            selected=dict(marker=dict(opacity=0)),
-            unselected=dict(marker=dict(opacity=1)),
-            marker=dict(
-                symbol='circle',
-                size=(8 + self.selected_df.loc[:, size]),
-                color=self.selected_df.loc[:, color],
-                colorscale=colorscale,
-                colorbar=dict(
-                    thicknessmode='pixels',
-                    thickness=20,
-                    title='Lattice energy'
-                ),
-                reversescale=True,
-                showscale=True
-            )
+        colorbar = dict(
+            thicknessmode='pixels',
+            thickness=20,
+            title='Lattice energy'
         )
-        # Diamond points and hiding the unselected points
-        trace1 = go.Scatter(
-            x=self.selected_df.loc[:, 'pos0'],
-            y=self.selected_df.loc[:, 'pos1'],
-            text=self.selected_df.loc[:, text],
-            mode='markers',
-            selectedpoints=tag_list,
-            selected=dict(marker=dict(opacity=1)),
-            unselected=dict(marker=dict(opacity=0)),
-            marker=dict(
-                symbol='diamond',
-                size=(8 + self.selected_df.loc[:, size]),
-                color=self.selected_df.loc[:, color],
-                colorscale=colorscale,
-                reversescale=True,
-                showscale=False
+        if webgl:
+            # Single trace, diamonds for the selected points
+            traces = [go.Scattergl(
+                x=df.loc[:, 'pos0'],
+                y=df.loc[:, 'pos1'],
+                text=df.loc[:, text],
+                mode='markers',
+                marker=dict(
+                    symbol=np.where(tagged[shown], 'diamond', 'circle'),
+                    size=(8 + df.loc[:, size]),
+                    color=df.loc[:, color],
+                    colorscale=colorscale,
+                    colorbar=colorbar,
+                    reversescale=True,
+                    showscale=True
+                )
+            )]
+        else:
+            # Circle points and hiding the selected points
+            trace0 = go.Scatter(
+                x=df.loc[:, 'pos0'],
+                y=df.loc[:, 'pos1'],
+                text=df.loc[:, text],
+                mode='markers',
+                selectedpoints=tag_list,
+                selected=dict(marker=dict(opacity=0)),
+                unselected=dict(marker=dict(opacity=1)),
+                marker=dict(
+                    symbol='circle',
+                    size=(8 + df.loc[:, size]),
+                    color=df.loc[:, color],
+                    colorscale=colorscale,
+                    colorbar=colorbar,
+                    reversescale=True,
+                    showscale=True
+                )
             )
-        )
+            # Diamond points and hiding the unselected points
+            trace1 = go.Scatter(
+                x=df.loc[:, 'pos0'],
+                y=df.loc[:, 'pos1'],
+                text=df.loc[:, text],
+                mode='markers',
+                selectedpoints=tag_list,
+                selected=dict(marker=dict(opacity=1)),
+                unselected=dict(marker=dict(opacity=0)),
+                marker=dict(
+                    symbol='diamond',
+                    size=(8 + df.loc[:, size]),
+                    color=df.loc[:, color],
+                    colorscale=colorscale,
+                    reversescale=True,
+                    showscale=False
+                )
+            )
+            traces = [trace0, trace1]
         # Hidden all axis
         axis_template = dict(
             showgrid=False,
@@ -289,10 +1110,8 @@ class MdsPlot(object):
         )
         # The plot function
         if lines:
-            plot_fig = go.Figure(
-                data=[trace0, trace1, edge_trace], layout=layout)
-        else:
-            plot_fig = go.Figure(data=[trace0, trace1], layout=layout)
+            traces.append(edge_trace)
+        plot_fig = go.Figure(data=traces, layout=layout)
         print(
             'Finished!\n'
             'Total time:{}'.format(datetime.now() - start)
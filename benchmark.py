@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the Gaussian input and output batch functions on synthetic
+corpora.
+@author: Yu Che
+"""
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from datetime import datetime
+
+from gaussian import GaussianInout, write_files
+
+parser = ArgumentParser(description='Script to benchmark the Gaussian input '
+                                    'and output functions on synthetic files')
+parser.add_argument('--sizes', '-s', dest='sizes', default='1000,10000,100000',
+                    help='Comma separated numbers of files in each corpus.')
+parser.add_argument('--operations', '-o', dest='operations', default='all',
+                    help='Comma separated operations, default is all.')
+parser.add_argument('--workers', '-w', dest='workers', type=int, default=1,
+                    help='The number of processes for parsing files.')
+parser.add_argument('--threads', '-t', dest='threads', type=int, default=1,
+                    help='The number of threads for writing and moving files.')
+parser.add_argument('--engine', '-e', dest='engine', default='stream',
+                    help='Output parser engine, stream or mmap.')
+parser.add_argument('--cache', dest='cache', action='store_true',
+                    help='Enable the parsed results cache.')
+parser.add_argument('--shards', dest='shards', type=int, default=10,
+                    help='The number of folders for files_distribution.')
+parser.add_argument('--large', dest='large', type=int, default=0,
+                    help='The number of large out files in each corpus.')
+parser.add_argument('--large-size', dest='large_size', type=int, default=200,
+                    help='The size of each large out file in MB.')
+parser.add_argument('--seed', dest='seed', type=int, default=0,
+                    help='Random seed of the synthetic corpora.')
+parser.add_argument('--root', '-r', dest='root', default=None,
+                    help='Working folder, a temporary folder by default.')
+parser.add_argument('--keep', dest='keep', action='store_true',
+                    help='Keep the synthetic files after the benchmark.')
+parser.add_argument('--output', dest='output', default=None,
+                    help='Append the results as JSON lines to this file.')
+parser.add_argument('--verbose', '-v', dest='verbose', action='store_true',
+                    help='Show the output of the benchmarked functions.')
+parser.add_argument('--case', dest='case', default=None,
+                    help=('Internal, run one operation in this process and '
+                          'print its result.'))
+
+# Benchmarked operations in running order, screening moves the out files
+OPERATIONS = ['prep_input', 'files_distribution', 'files_redistribution',
+              'error_screening', 'neg_freq_screening', 'obtain_structure']
+METHOD, MOL, SEQ = 'PM7_opt', 'bench', 'synthetic'
+HEADER = ('%NProcShared=40\n%Mem=100GB\n%Chk=placeholder\n'
+          '# opt freq pm7\n\nbenchmark\n\n0 1\n')
+ELEMENTS = [(1, 'H'), (6, 'C'), (7, 'N'), (8, 'O'), (9, 'F'), (16, 'S'),
+            (17, 'Cl')]
+# Failed links seen in real runs, l9999 is the most common one
+ERROR_LINKS = [9999, 9999, 9999, 502, 502, 101, 103, 202, 716, 1]
+# Output kinds and their weights in the corpus
+KINDS = ['normal'] * 12 + ['neg_freq'] * 3 + ['error'] * 3 + ['unfinished'] * 2
+RULE = ' ' + '-' * 69 + '\n'
+# ru_maxrss is in KB on Linux and in bytes on macOS
+RSS_UNIT = 1024 ** 2 if sys.platform == 'darwin' else 1024
+
+
+def orientation(atoms, rnd):
+    """
+    Standard orientation table of a geometry optimisation step.
+
+    :param atoms: The atomic numbers
+    :param rnd: The random number generator
+    :type atoms: list
+    :type rnd: random.Random
+    :return: The table text
+    :rtype: str
+    """
+    lines = [' ' * 25 + 'Standard orientation:' + ' ' * 25 + '\n', RULE,
+             ' Center     Atomic      Atomic             Coordinates '
+             '(Angstroms)\n',
+             ' Number     Number       Type             X           Y'
+             '           Z\n', RULE]
+    for i, number in enumerate(atoms):
+        lines.append(' {:>6} {:>10} {:>11} {:>15.6f} {:>11.6f} {:>11.6f}\n'
+                     .format(i + 1, number, 0, rnd.uniform(-9, 9),
+                             rnd.uniform(-9, 9), rnd.uniform(-9, 9)))
+    lines.append(RULE)
+    return ''.join(lines)
+
+
+def optimisation_step(atoms, rnd):
+    """
+    One geometry optimisation step with its SCF energy and convergence
+    table.
+
+    :param atoms: The atomic numbers
+    :param rnd: The random number generator
+    :type atoms: list
+    :type rnd: random.Random
+    :return: The step text
+    :rtype: str
+    """
+    return (
+        orientation(atoms, rnd) +
+        ' SCF Done:  E(RPM7) =  -0.{:012d}E-01     A.U. after   {:>2} cycles'
+        '\n'.format(rnd.randint(10 ** 10, 10 ** 11), rnd.randint(8, 30)) +
+        ' Item               Value     Threshold  Converged?\n'
+        ' Maximum Force            {:.6f}     0.000450     NO \n'
+        ' RMS     Force            {:.6f}     0.000300     NO \n'.format(
+            rnd.uniform(0, 0.01), rnd.uniform(0, 0.01)
+        )
+    )
+
+
+def job_tail(kind, rnd):
+    """
+    The final lines of an output file, these decide the termination type.
+
+    :param kind: One of 'normal', 'neg_freq' and 'error'
+    :param rnd: The random number generator
+    :type kind: str
+    :type rnd: random.Random
+    :return: The tail text
+    :rtype: str
+    """
+    timing = (' Job cpu time:       0 days  0 hours {:>2} minutes {:>4.1f} '
+              'seconds.\n'
+              ' Elapsed time:       0 days  0 hours {:>2} minutes {:>4.1f} '
+              'seconds.\n'
+              ' File lengths (MBytes):  RWF=     50 Int=      0 D2E=      0 '
+              'Chk=      2 Scr=      1\n').format(
+        rnd.randint(0, 59), rnd.uniform(0, 59), rnd.randint(0, 59),
+        rnd.uniform(0, 59)
+    )
+    if kind == 'error':
+        return (' Error termination via Lnk1e in /apps/g16/l{}.exe at '
+                'Sun Mar 10 12:00:00 2019.\n'.format(rnd.choice(ERROR_LINKS))
+                + timing)
+    frequency = rnd.uniform(5, 80)
+    if kind == 'neg_freq':
+        frequency = -frequency
+    return (
+        ' Frequencies --   {:>10.4f}              {:>10.4f}              '
+        '{:>10.4f}\n'.format(frequency, abs(frequency) + 3,
+                             abs(frequency) + 7) +
+        ' Frequencies --   {:>10.4f}              {:>10.4f}              '
+        '{:>10.4f}\n'.format(abs(frequency) + 12, abs(frequency) + 20,
+                             abs(frequency) + 31) +
+        timing +
+        ' Normal termination of Gaussian 16 at Sun Mar 10 12:00:00 2019.\n'
+    )
+
+
+def output_text(kind, rnd, steps):
+    """
+    Synthetic Gaussian output file text.
+
+    :param kind: One of 'normal', 'neg_freq', 'error' and 'unfinished'
+    :param rnd: The random number generator
+    :param steps: The number of optimisation steps
+    :type kind: str
+    :type rnd: random.Random
+    :type steps: int
+    :return: The file text
+    :rtype: str
+    """
+    atoms = [rnd.choice(ELEMENTS)[0] for _ in range(rnd.randint(8, 60))]
+    text = [' Entering Gaussian System, Link 0=g16\n',
+            ' #p opt freq pm7\n']
+    text.extend(optimisation_step(atoms, rnd) for _ in range(steps))
+    if kind == 'unfinished':
+        return ''.join(text)
+    text.append('    -- Stationary point found.\n'
+                ' Optimization completed.\n')
+    text.append(optimisation_step(atoms, rnd))
+    text.append(job_tail(kind, rnd))
+    return ''.join(text)
+
+
+def write_large_output(path, kind, rnd, size):
+    """
+    Writing a large output file step by step, the whole text is never held
+    in memory.
+
+    :param path: The file path
+    :param kind: The output kind
+    :param rnd: The random number generator
+    :param size: The file size in MB
+    :type path: str
+    :type kind: str
+    :type rnd: random.Random
+    :type size: int
+    :return: None
+    """
+    atoms = [rnd.choice(ELEMENTS)[0] for _ in range(200)]
+    with open(path, 'w') as file:
+        file.write(' Entering Gaussian System, Link 0=g16\n'
+                   ' #p opt freq pm7\n')
+        while file.tell() < size * 1024 ** 2:
+            file.write(optimisation_step(atoms, rnd))
+        if kind != 'unfinished':
+            file.write('    -- Stationary point found.\n'
+                       ' Optimization completed.\n')
+            file.write(optimisation_step(atoms, rnd))
+            file.write(job_tail(kind, rnd))
+
+
+def molecule_text(suffix, rnd):
+    """
+    Synthetic MOL or XYZ file text.
+
+    :param suffix: '.mol' or '.xyz'
+    :param rnd: The random number generator
+    :type suffix: str
+    :type rnd: random.Random
+    :return: The file text
+    :rtype: str
+    """
+    symbols = [rnd.choice(ELEMENTS)[1] for _ in range(rnd.randint(8, 60))]
+    coordinates = [(rnd.uniform(-9, 9), rnd.uniform(-9, 9),
+                    rnd.uniform(-9, 9)) for _ in symbols]
+    if suffix == '.xyz':
+        return '{}\nsynthetic\n'.format(len(symbols)) + ''.join(
+            '{:<2}{:>14.6f}{:>14.6f}{:>14.6f}\n'.format(symbol, *xyz)
+            for symbol, xyz in zip(symbols, coordinates)
+        )
+    lines = ['synthetic\n     RDKit          3D\n\n',
+             '{:>3}{:>3}  0  0  0  0  0  0  0  0999 V2000\n'.format(
+                 len(symbols), len(symbols) - 1)]
+    lines.extend(
+        '{:>10.4f}{:>10.4f}{:>10.4f} {:<3} 0  0  0  0  0  0  0  0  0  0  0'
+        '  0\n'.format(x, y, z, symbol)
+        for symbol, (x, y, z) in zip(symbols, coordinates)
+    )
+    lines.extend('{:>3}{:>3}  1  0\n'.format(i, i + 1)
+                 for i in range(1, len(symbols)))
+    lines.append('M  END\n')
+    return ''.join(lines)
+
+
+def generate_corpus(root, size, args):
+    """
+    Creating the molecule files, the header file and the Gaussian out files
+    of one corpus.
+
+    :param root: The root path of the corpus
+    :param size: The number of molecule and out files
+    :param args: The command line arguments
+    :type root: str
+    :type size: int
+    :return: The number of each output kind
+    :rtype: dict
+    """
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+    with open(root + '/header_{}'.format(METHOD), 'w') as header:
+        header.write(HEADER)
+    gauss = GaussianInout(METHOD, MOL, SEQ, root_path=root)
+    gauss.setup_cache(False)
+    os.makedirs(gauss.mol_origin)
+    rnd = random.Random(args.seed)
+    kinds = [rnd.choice(KINDS) for _ in range(size)]
+    counts = {kind: kinds.count(kind) for kind in set(KINDS)}
+
+    def molecules():
+        for i in range(size):
+            suffix = '.mol' if i % 2 else '.xyz'
+            yield (gauss.mol_origin + '/mol_{:06d}{}'.format(i, suffix),
+                   molecule_text(suffix, rnd))
+
+    def outputs():
+        for i, kind in enumerate(kinds[args.large:], args.large):
+            yield (gauss.origin_result_folder + '/mol_{:06d}.out'.format(i),
+                   output_text(kind, rnd, rnd.randint(1, 8)))
+    write_files(molecules(), args.threads)
+    write_files(outputs(), args.threads)
+    for i, kind in enumerate(kinds[:args.large]):
+        write_large_output(
+            gauss.origin_result_folder + '/mol_{:06d}.out'.format(i), kind,
+            rnd, args.large_size
+        )
+    return counts
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process. Linux keeps ru_maxrss over exec,
+    so the high water mark of /proc is used if it exists.
+
+    :return: The peak RSS in MB
+    :rtype: float
+    """
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / RSS_UNIT
+
+
+def run_case(root, operation, args):
+    """
+    Running one operation on an existing corpus and measuring its time and
+    peak memory.
+
+    :param root: The root path of the corpus
+    :param operation: The operation name
+    :param args: The command line arguments
+    :type root: str
+    :type operation: str
+    :return: The profiling summary with the peak RSS in MB
+    :rtype: dict
+    """
+    os.chdir(root)
+    gauss = GaussianInout(METHOD, MOL, SEQ, root_path=root)
+    gauss.setup_engine(args.engine)
+    gauss.setup_cache(args.cache)
+    input_origin_folder = gauss.input_folder + '/' + gauss.mol_name
+    if operation == 'prep_input':
+        summary = gauss.prep_input('local', args.workers, args.threads)
+    elif operation == 'files_distribution':
+        summary = gauss.files_distribution(
+            input_origin_folder, args.shards, args.threads
+        )
+    elif operation == 'files_redistribution':
+        summary = gauss.files_redistribution(
+            input_origin_folder, args.threads
+        )
+    elif operation == 'error_screening':
+        summary = gauss.error_screening(args.workers, args.threads)
+    elif operation == 'neg_freq_screening':
+        summary = gauss.neg_freq_screening(args.workers, args.threads)
+    else:
+        summary = gauss.obtain_structure(args.workers)
+    summary['peak_rss'] = peak_rss()
+    summary['peak_rss_workers'] = resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss / RSS_UNIT
+    return summary
+
+
+def benchmark(args):
+    """
+    Timing each operation at each corpus size. Every operation is run in a
+    new process, so the peak RSS is measured separately.
+
+    :param args: The command line arguments
+    :return: The results of all operations
+    :rtype: list
+    """
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.operations == 'all':
+        operations = OPERATIONS
+    else:
+        operations = [operation for operation in OPERATIONS
+                      if operation in args.operations.split(',')]
+    work_folder = args.root or tempfile.mkdtemp(prefix='gaussian_bench_')
+    results = []
+    print('{:>8} {:<22}{:>10}{:>10}{:>12}{:>10}{:>10}'.format(
+        'Files', 'Operation', 'Time/s', 'Counted', 'Files/s', 'RSS/MB',
+        'Workers'
+    ))
+    try:
+        for size in sizes:
+            root = os.path.abspath(work_folder + '/corpus_{}'.format(size))
+            start = datetime.now()
+            counts = generate_corpus(root, size, args)
+            if args.verbose:
+                print('Corpus of {} files: {} Time:{}'.format(
+                    size, counts, datetime.now() - start
+                ))
+            for operation in operations:
+                case = json.dumps({'root': root, 'operation': operation})
+                command = [sys.executable, os.path.abspath(__file__),
+                           '--case', case] + sys.argv[1:]
+                process = subprocess.run(
+                    command, stdout=subprocess.PIPE, universal_newlines=True,
+                    check=True
+                )
+                lines = process.stdout.splitlines()
+                if args.verbose:
+                    print('\n'.join(lines[:-1]))
+                summary = json.loads(lines[-1])
+                counters = summary['counters']
+                files = counters.get('files') or counters.get('moves', 0)
+                result = {
+                    'size': size, 'operation': operation,
+                    'time': summary['total_time'], 'files': files,
+                    'files_per_second': files / summary['total_time'],
+                    'peak_rss': summary['peak_rss'],
+                    'peak_rss_workers': summary['peak_rss_workers'],
+                    'workers': args.workers, 'threads': args.threads,
+                    'engine': args.engine, 'cache': args.cache,
+                    'phases': summary['phases'], 'counters': counters
+                }
+                results.append(result)
+                print('{:>8} {:<22}{:>10.3f}{:>10}{:>12.1f}{:>10.1f}{:>10.1f}'
+                      .format(size, operation, result['time'], files,
+                              result['files_per_second'], result['peak_rss'],
+                              result['peak_rss_workers']))
+            if not args.keep:
+                shutil.rmtree(root)
+    finally:
+        if not args.keep and args.root is None:
+            shutil.rmtree(work_folder, ignore_errors=True)
+    if args.output is not None:
+        with open(args.output, 'a') as output:
+            output.writelines(json.dumps(result) + '\n' for result in results)
+    return results
+
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    if arguments.case is not None:
+        case = json.loads(arguments.case)
+        print(json.dumps(run_case(case['root'], case['operation'],
+                                  arguments)))
+    else:
+        benchmark(arguments)
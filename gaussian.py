@@ -4,10 +4,1219 @@
 Gaussian 16 input and output files preparation.
 @author: Yu Che
 """
+import cProfile
+import errno
+import hashlib
+import heapq
+import io
+import json
+import mmap
 import os
+import pstats
 import shutil
+import sqlite3
 import re
+import time
+import numpy as np
+from collections import defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from itertools import islice
+
+
+def read_tail(path, n_lines=4, block_size=4096):
+    """
+    Reading the last lines of a text file by seeking from the end, so that
+    only the final few KB of a large output file are loaded.
+
+    :param path: The path for the file
+    :param n_lines: The number of lines to be returned
+    :param block_size: The number of bytes read for each backward step
+    :type path: str
+    :type n_lines: int
+    :type block_size: int
+    :return: The last lines including their line breaks
+    :rtype: list
+    """
+    with open(path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        data = b''
+        # One extra line break is needed to make sure the first line is full
+        while position > 0 and data.count(b'\n') <= n_lines:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+    # Universal newlines as same as reading the file in text mode
+    text = data.decode('utf-8', errors='replace')
+    return io.StringIO(text, newline=None).readlines()[-n_lines:]
+
+
+# Compact record of one Gaussian output file
+GaussianResult = namedtuple(
+    'GaussianResult',
+    ['status', 'error', 'scf_energies', 'energy', 'lowest_freq', 'geometry',
+     'n_atoms', 'wall_time']
+)
+# Final geometry: atomic numbers and (N, 3) Cartesian coordinates in Angstrom
+GEOMETRY_DTYPE = np.dtype([('number', np.int32), ('xyz', np.float64, (3,))])
+# Line prefixes handled by the output parser
+OUTPUT_PREFIXES = (
+    ' SCF Done', ' Center', ' Optimization completed', ' Frequencies',
+    ' Elapsed time'
+)
+# Wall time of each job step in days, hours, minutes and seconds
+ELAPSED_PATTERN = (
+    r'\n Elapsed time:\s+(\S+) days\s+(\S+) hours\s+(\S+) minutes\s+(\S+)'
+)
+# Byte patterns for the memory-mapped output parser, the leading line break
+# lets the regex engine search for the literal prefix
+SCF_PATTERN = re.compile(rb'\n SCF Done\S*\s+\S+\s+\S+\s+(\S+)')
+FREQ_PATTERN = re.compile(rb'\n Frequencies\S*\s+\S+\s+(\S+)')
+ELAPSED_BYTES_PATTERN = re.compile(ELAPSED_PATTERN.encode())
+ELAPSED_LINE_PATTERN = re.compile(ELAPSED_PATTERN[2:])
+
+
+def classify_termination(lines):
+    """
+    Classifying a Gaussian output file by its last four lines.
+
+    :param lines: The last lines of a Gaussian out file
+    :type lines: list
+    :return: ('normal', None), ('error', link code) or ('unfinished', None)
+    :rtype: tuple
+    """
+    # Checking the ending line
+    if not lines or not re.match(r' File| Normal', lines[-1]):
+        return 'unfinished', None
+    # Checking the error indicator
+    error_line = lines[0] if len(lines) == 4 else ''
+    if error_line.startswith(' Error termination'):
+        return 'error', re.split(r'[/.]', error_line)[-3][1:]
+    return 'normal', None
+
+
+def termination_status(path):
+    """
+    Classifying a Gaussian output file by its termination lines.
+
+    :param path: The path for a Gaussian out file
+    :type path: str
+    :return: ('normal', None), ('error', link code) or ('unfinished', None)
+    :rtype: tuple
+    """
+    return classify_termination(read_tail(path, n_lines=4))
+
+
+def energy_value(energy_str):
+    """
+    Converting an SCF energy string into the value written in XYZ files.
+
+    :param energy_str: The energy field of a 'SCF Done' line
+    :type energy_str: str
+    :return: Float for exponent format, otherwise the origin string
+    """
+    if 'E' in energy_str:
+        energy_e = energy_str.split('E')
+        return float(energy_e[0]) * 10 ** int(energy_e[1])
+    return energy_str
+
+
+def elapsed_seconds(fields):
+    """
+    Converting the fields of an 'Elapsed time' line into seconds.
+
+    :param fields: The days, hours, minutes and seconds strings
+    :type fields: tuple
+    :return: The wall time in seconds
+    :rtype: float
+    """
+    days, hours, minutes, seconds = (float(field) for field in fields)
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def geometry_array(table):
+    """
+    Converting the rows of a Gaussian coordinates table into a geometry
+    array in one step.
+
+    :param table: The text of the atom rows
+    :type table: str
+    :return: Structured array with 'number' and 'xyz' fields
+    :rtype: numpy.ndarray
+    """
+    values = np.array(table.split(), dtype=np.float64).reshape(-1, 6)
+    geometry = np.empty(len(values), dtype=GEOMETRY_DTYPE)
+    geometry['number'] = values[:, 1]
+    geometry['xyz'] = values[:, 3:6]
+    return geometry
+
+
+def parse_output(path, tail_only=False, engine='stream'):
+    """
+    Reading a Gaussian output file in a single pass.\n
+    The final geometry is the last coordinates table before the first
+    'Optimization completed' line and its energy is the first 'SCF Done'
+    after that table. The lowest frequency is the first non-zero value of
+    the 'Frequencies' lines.
+
+    :param path: The path for a Gaussian out file
+    :param tail_only: Only checking the termination by seeking the file tail
+    :param engine: 'stream' for reading line by line or 'mmap' for scanning
+    the memory-mapped file with byte patterns
+    :type path: str
+    :type tail_only: bool
+    :type engine: str
+    :return: The parsed result
+    :rtype: GaussianResult
+    """
+    if engine == 'mmap' and not tail_only:
+        return _parse_output_mmap(path)
+    if tail_only:
+        status, error = termination_status(path)
+        return GaussianResult(
+            status, error, None, None, None, None, None, None
+        )
+    tail = deque(maxlen=4)
+    scf_energies = []
+    energy, lowest_freq, geometry = None, None, None
+    block, block_energy = [], None
+    completed = False
+    # Summed over all job steps
+    wall_time = None
+    # Lines to skip before the atoms of a coordinates table, -1 for outside
+    table = -1
+    with open(path, 'r') as gauss_out:
+        for line in gauss_out:
+            tail.append(line)
+            if table > 0:
+                table -= 1
+                continue
+            if table == 0:
+                if line.startswith(' -'):
+                    table = -1
+                else:
+                    block.append(line)
+                continue
+            if not line.startswith(OUTPUT_PREFIXES):
+                continue
+            if line.startswith(' SCF Done'):
+                energy_str = re.split(r'\s+', line)[5]
+                scf_energies.append(float(energy_str))
+                if block_energy is None:
+                    block_energy = energy_str
+            elif line.startswith(' Center'):
+                if not completed and 'Coordinates (Angstroms)' in line:
+                    block, block_energy = [], None
+                    table = 2
+            elif line.startswith(' Optimization completed'):
+                if not completed:
+                    completed = True
+                    geometry, energy = block, block_energy
+            elif line.startswith(' Elapsed time'):
+                match = ELAPSED_LINE_PATTERN.match(line)
+                if match:
+                    wall_time = (wall_time or 0) + elapsed_seconds(
+                        match.groups()
+                    )
+            elif lowest_freq is None:
+                frequency = float(re.split(r'\s+', line)[3])
+                if frequency != 0:
+                    lowest_freq = frequency
+    status, error = classify_termination(list(tail))
+    if geometry is not None:
+        geometry = geometry_array(''.join(geometry))
+    return GaussianResult(
+        status, error, scf_energies, energy, lowest_freq, geometry,
+        len(geometry) if geometry is not None else None, wall_time
+    )
+
+
+def _parse_output_mmap(path):
+    """
+    Memory-mapped version of parse_output. Compiled byte patterns jump
+    to the required blocks and only the final coordinates table is decoded.
+
+    :param path: The path for a Gaussian out file
+    :type path: str
+    :return: The parsed result
+    :rtype: GaussianResult
+    """
+    status, error = termination_status(path)
+    if os.path.getsize(path) == 0:
+        return GaussianResult(
+            status, error, [], None, None, None, None, None
+        )
+    energy, lowest_freq, geometry, wall_time = None, None, None, None
+    with open(path, 'rb') as gauss_out, \
+            mmap.mmap(gauss_out.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        scf_energies = [float(match) for match in SCF_PATTERN.findall(data)]
+        for match in FREQ_PATTERN.finditer(data):
+            frequency = float(match.group(1))
+            if frequency != 0:
+                lowest_freq = frequency
+                break
+        for match in ELAPSED_BYTES_PATTERN.finditer(data):
+            wall_time = (wall_time or 0) + elapsed_seconds(match.groups())
+        completed = data.find(b'\n Optimization completed')
+        # The last coordinates table before the optimisation completed
+        header = completed
+        while header > 0:
+            header = data.rfind(b'Coordinates (Angstroms)', 0, header)
+            line_start = data.rfind(b'\n', 0, header) + 1
+            if header >= 0 and data[line_start:line_start + 7] == b' Center':
+                break
+        if completed >= 0 and header >= 0:
+            # Skipping the table header and the separator lines
+            start = header
+            for _ in range(3):
+                start = data.find(b'\n', start) + 1
+            end = data.find(b'\n -', start - 1, completed)
+            if start and end >= 0:
+                geometry = geometry_array(data[start:end].decode())
+                match = SCF_PATTERN.search(data, end, completed)
+                if match:
+                    energy = match.group(1).decode()
+    return GaussianResult(
+        status, error, scf_energies, energy, lowest_freq, geometry,
+        len(geometry) if geometry is not None else None, wall_time
+    )
+
+
+def gjf_atoms(path):
+    """
+    Counting the atoms of a Gaussian input file, the lines of the molecule
+    specification section after the charge and multiplicity line.
+
+    :param path: The path for a gjf file
+    :type path: str
+    :return: The number of atoms, 0 for checkpoint geometries
+    :rtype: int
+    """
+    section, atoms = 0, -1
+    with open(path, 'r') as gjf:
+        for line in gjf:
+            if not line.strip():
+                section += 1
+                if section == 3:
+                    break
+            elif section == 2:
+                atoms += 1
+    return max(atoms, 0)
+
+
+def balance_shards(costs, shards):
+    """
+    Bin-packing items into shards with balanced total cost. Items are
+    taken from the most expensive one and always added to the cheapest
+    shard (longest processing time first). Ties go to the shard with
+    fewer items, so items without cost are still spread evenly.
+
+    :param costs: The cost of each item
+    :param shards: The number of shards
+    :type costs: list
+    :type shards: int
+    :return: The item indices of each shard
+    :rtype: list
+    """
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    heap = [(0, 0, k) for k in range(shards)]
+    groups = [[] for _ in range(shards)]
+    for i in order:
+        total, count, k = heapq.heappop(heap)
+        groups[k].append(i)
+        heapq.heappush(heap, (total + costs[i], count + 1, k))
+    return [sorted(group) for group in groups]
+
+
+def scan_files(folder, suffix=None, skipped=None):
+    """
+    Streaming the regular files of a folder with os.scandir. Hidden files
+    are ignored and the directory entries are yielded lazily, so a huge
+    folder can be processed without holding the whole listing.
+
+    :param folder: The targeted folder
+    :param suffix: Only yielding files with this suffix
+    :param skipped: Called with the entries without the suffix
+    :type folder: str
+    :type suffix: str or tuple
+    :return: Generator of os.DirEntry
+    """
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            if suffix is not None and not entry.name.endswith(suffix):
+                if skipped is not None:
+                    skipped(entry)
+                continue
+            yield entry
+
+
+def _apply(func, chunk):
+    """
+    Applying a function to a chunk of items in a worker process.
+
+    :return: The list of results
+    :rtype: list
+    """
+    return [func(item) for item in chunk]
+
+
+def parallel_imap(func, items, workers=1, chunk_size=16):
+    """
+    Lazily applying a function to all items, optionally using a process
+    pool. The items are consumed as a bounded work queue with at most two
+    chunks per process in flight and the results are yielded in the order
+    of the items.
+
+    :param func: A picklable module level function
+    :param items: The arguments for each function call, can be a generator
+    :param workers: The number of processes, None for all CPU cores
+    :param chunk_size: The number of items sent to a process at once
+    :type workers: int
+    :type chunk_size: int
+    :return: Generator of results
+    """
+    if workers == 1:
+        for item in items:
+            yield func(item)
+        return
+    n_workers = workers or os.cpu_count() or 1
+    items = iter(items)
+    chunks = iter(lambda: list(islice(items, chunk_size)), [])
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(_apply, func, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _parse_many(paths, tail_only=False, engine='stream'):
+    """
+    Parsing a chunk of Gaussian out files in a worker process.
+
+    :return: The list of GaussianResult records
+    :rtype: list
+    """
+    return [parse_output(path, tail_only, engine) for path in paths]
+
+
+class InputTemplate:
+    """
+    Precompiled Gaussian input template.\n
+    The header is parsed once into constant text parts and checkpoint
+    slots, so rendering an input file is a single string join.
+    """
+    def __init__(self, header, chk_path, geometry):
+        """
+        :param header: The lines of the header file
+        :param chk_path: The chk line prefix, the molecule name and '.chk'
+        are added for each input file
+        :param geometry: 'local' for adding coordinates or 'chk' for reading
+        the geometry from the checkpoint file
+        :type header: list
+        :type chk_path: str
+        :type geometry: str
+        """
+        self.chk_path = chk_path
+        self.geometry = geometry
+        lines = list(header)
+        if geometry == 'chk':
+            if not any(line.startswith('# Geom') for line in lines):
+                lines.insert(4, '# Geom=Checkpoint Guess=Read\n')
+        # Constant text parts, None for checkpoint slots
+        self.parts = []
+        text = ''
+        for line in lines:
+            if line.startswith('%Chk'):
+                self.parts.extend([text, None])
+                text = ''
+            else:
+                text += line
+        self.parts.append(text)
+
+    def render(self, name, coordinates=''):
+        """
+        Rendering the input file text for one molecule.
+
+        :param name: The molecule name used for the checkpoint file
+        :param coordinates: The coordinates lines of the molecule
+        :type name: str
+        :type coordinates: str
+        :return: The input file text
+        :rtype: str
+        """
+        chk_line = self.chk_path + '{}.chk\n'.format(name)
+        text = ''.join(chk_line if part is None else part
+                       for part in self.parts)
+        if self.geometry == 'local':
+            # Adding terminate line
+            text += coordinates + '\n'
+        return text
+
+
+def read_coordinates(path, symbols):
+    """
+    Reading the atoms coordinates of a MOL or XYZ file as XYZ lines.
+
+    :param path: The path for a MOL or XYZ file
+    :param symbols: The supported element symbols
+    :type path: str
+    :type symbols: set
+    :return: The coordinates lines
+    :rtype: str
+    """
+    coordinate_lines = []
+    with open(path, 'r') as data:
+        # Mol format
+        if path.endswith('.mol'):
+            for line in data:
+                segments = line.split()
+                # Fields are shifted by the leading white space
+                shift = 1 if line[:1].isspace() else 0
+                if (len(segments) > 4 - shift and
+                        segments[4 - shift] in symbols):
+                    coordinate_lines.append(
+                        '{}{:>14}{:>14}{:>14}\n'.format(
+                            segments[4 - shift],
+                            segments[1 - shift],
+                            segments[2 - shift],
+                            segments[3 - shift]
+                        )
+                    )
+        # XYZ format
+        elif path.endswith('.xyz'):
+            for line in data:
+                if line[:1].isalpha():
+                    coordinate_lines.append(line)
+    return ''.join(coordinate_lines)
+
+
+def _render_gjf(file, mol_origin, input_folder, template, symbols):
+    """
+    Rendering one Gaussian input file from a molecule file.
+
+    :return: The input file path and text
+    :rtype: tuple
+    """
+    # Get the molecular name
+    name = file.split('.')[0]
+    coordinates = ''
+    if template.geometry == 'local':
+        coordinates = read_coordinates(mol_origin + '/' + file, symbols)
+    return '{}/{}.gjf'.format(input_folder, name), template.render(
+        name, coordinates
+    )
+
+
+def _write_batch(batch):
+    """
+    Writing a batch of text files.
+
+    :param batch: The (path, text) pairs
+    :type batch: list
+    :return: The number of files
+    :rtype: int
+    """
+    for path, text in batch:
+        with open(path, 'w') as file:
+            file.write(text)
+    return len(batch)
+
+
+def write_files(items, threads=1, batch_size=500, callback=None):
+    """
+    Writing text files in batches, optionally using a thread pool for the
+    I/O bound write phase. Only a few batches are held in memory.
+
+    :param items: The (path, text) pairs, can be a generator
+    :param threads: The number of writing threads
+    :param batch_size: The number of files in each batch
+    :param callback: Called with the paths of each finished batch
+    :type threads: int
+    :type batch_size: int
+    :return: The number of written files
+    :rtype: int
+    """
+    items = iter(items)
+    batches = iter(lambda: list(islice(items, batch_size)), [])
+    written = 0
+    if threads == 1:
+        for batch in batches:
+            written += _write_batch(batch)
+            if callback is not None:
+                callback([path for path, _ in batch])
+        return written
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for batch in batches:
+            paths = [path for path, _ in batch]
+            pending.append((executor.submit(_write_batch, batch), paths))
+            while pending and (len(pending) >= 2 * threads or
+                               pending[0][0].done()):
+                future, paths = pending.popleft()
+                written += future.result()
+                if callback is not None:
+                    callback(paths)
+        while pending:
+            future, paths = pending.popleft()
+            written += future.result()
+            if callback is not None:
+                callback(paths)
+    return written
+
+
+class ParseCache:
+    """
+    On-disk SQLite cache of parsed Gaussian output records.\n
+    Records are keyed by the file name, size and modification time, so a
+    result stays valid after the file is moved between the screening
+    folders and is parsed again once the file changes.\n
+    The stored bytes of each record are kept in the length column and
+    their running total in self.total, so the size cap is checked without
+    scanning the table.
+    """
+    # Increased whenever the table columns change
+    version = 5
+
+    def __init__(self, path, max_size=512):
+        """
+        :param path: The path for the SQLite database file
+        :param max_size: The size cap of all cached records in MB
+        :type path: str
+        :type max_size: int
+        """
+        self.path = path
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path, timeout=60)
+        version = self.connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != self.version:
+            self.connection.execute('DROP TABLE IF EXISTS results')
+            self.connection.execute(
+                'PRAGMA user_version = {:d}'.format(self.version)
+            )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+            'full INTEGER, accessed REAL, length INTEGER, status TEXT, '
+            'error TEXT, '
+            'scf_energies BLOB, energy TEXT, lowest_freq REAL, '
+            'geometry BLOB, n_atoms INTEGER, wall_time REAL)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)'
+        )
+        self.connection.commit()
+        self.total = self._stored_bytes()
+
+    def get_many(self, paths, stats, tail_only=False):
+        """
+        Looking up the cached records for files.
+
+        :param paths: The paths for Gaussian out files
+        :param stats: The os.stat results of the files
+        :param tail_only: Tail-only records are enough for the request
+        :type paths: list
+        :type stats: list
+        :type tail_only: bool
+        :return: The records, None for missing or changed files
+        :rtype: list
+        """
+        records, hits = [], []
+        for path, stat in zip(paths, stats):
+            name = os.path.basename(path)
+            row = self.connection.execute(
+                'SELECT size, mtime, full, status, error, scf_energies, '
+                'energy, lowest_freq, geometry, n_atoms, wall_time '
+                'FROM results WHERE name = ?', (name,)
+            ).fetchone()
+            if (row is None or row[0] != stat.st_size or
+                    row[1] != stat.st_mtime_ns or not (row[2] or tail_only)):
+                records.append(None)
+            else:
+                status, error, scf_energies, energy, lowest_freq, \
+                    geometry, n_atoms, wall_time = row[3:]
+                if scf_energies is not None:
+                    scf_energies = np.frombuffer(
+                        scf_energies, dtype='<f8'
+                    ).tolist()
+                if geometry is not None:
+                    geometry = np.frombuffer(
+                        geometry, dtype=GEOMETRY_DTYPE
+                    ).copy()
+                records.append(GaussianResult(
+                    status, error, scf_energies, energy, lowest_freq,
+                    geometry, n_atoms, wall_time
+                ))
+                hits.append(name)
+        if hits:
+            now = time.time()
+            self.connection.executemany(
+                'UPDATE results SET accessed = ? WHERE name = ?',
+                [(now, name) for name in hits]
+            )
+            self.connection.commit()
+        return records
+
+    def put_many(self, paths, stats, records, tail_only=False):
+        """
+        Storing parsed records, replacing stale entries of the same files.
+
+        :param paths: The paths for Gaussian out files
+        :param stats: The os.stat results before parsing
+        :param records: The parsed GaussianResult records
+        :param tail_only: The records are tail-only records
+        :type paths: list
+        :type stats: list
+        :type records: list
+        :type tail_only: bool
+        :return: None
+        """
+        now = time.time()
+        rows = []
+        for path, stat, record in zip(paths, stats, records):
+            columns = self._columns(record)
+            # Blob bytes and a fixed overhead of the other columns
+            length = len(columns[2] or b'') + len(columns[5] or b'') + 64
+            rows.append((os.path.basename(path), stat.st_size,
+                         stat.st_mtime_ns, int(not tail_only), now,
+                         length) + columns)
+        # Replaced records no longer count
+        names = [row[0] for row in rows]
+        replaced = 0
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            replaced += self.connection.execute(
+                'SELECT COALESCE(SUM(length), 0) FROM results WHERE name '
+                'IN ({})'.format(', '.join('?' * len(chunk))), chunk
+            ).fetchone()[0]
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO results VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+        )
+        self.connection.commit()
+        self.total += sum(row[5] for row in rows) - replaced
+        if self.total > self.max_size * 1024 ** 2:
+            self.prune()
+
+    @staticmethod
+    def _columns(record):
+        """
+        Converting a record into plain column values, the arrays are stored
+        as raw little-endian bytes.
+
+        :param record: The parsed record
+        :type record: GaussianResult
+        :return: The column values in the order of the table
+        :rtype: tuple
+        """
+        scf_energies, geometry = record.scf_energies, record.geometry
+        if scf_energies is not None:
+            scf_energies = np.asarray(scf_energies, dtype='<f8').tobytes()
+        if geometry is not None:
+            geometry = np.asarray(geometry, dtype=GEOMETRY_DTYPE).tobytes()
+        return (
+            record.status, record.error, scf_energies, record.energy,
+            record.lowest_freq, geometry, record.n_atoms, record.wall_time
+        )
+
+    def prune(self):
+        """
+        Deleting the least recently used records above the size cap. The
+        records are pruned to 90% of the cap, so a full cache is not pruned
+        again for every new chunk.
+
+        :return: None
+        """
+        # Other processes may share the database
+        self.total = self._stored_bytes()
+        if self.total <= self.max_size * 1024 ** 2:
+            return
+        excess = self.total - int(0.9 * self.max_size * 1024 ** 2)
+        if excess <= 0:
+            return
+        names, freed = [], 0
+        for name, length in self.connection.execute(
+                'SELECT name, length FROM results ORDER BY accessed'):
+            if freed >= excess:
+                break
+            names.append((name,))
+            freed += length
+        self.connection.executemany(
+            'DELETE FROM results WHERE name = ?', names
+        )
+        self.connection.commit()
+        self.total -= freed
+
+    def _stored_bytes(self):
+        """
+        Summing the stored bytes of all records.
+
+        :return: The total length
+        :rtype: int
+        """
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(length), 0) FROM results'
+        ).fetchone()[0]
+
+    def invalidate(self, paths=None):
+        """
+        Removing cached records.
+
+        :param paths: The files to be removed, None for all records
+        :type paths: list
+        :return: None
+        """
+        if paths is None:
+            self.connection.execute('DELETE FROM results')
+        else:
+            self.connection.executemany(
+                'DELETE FROM results WHERE name = ?',
+                [(os.path.basename(path),) for path in paths]
+            )
+        self.connection.commit()
+        self.total = self._stored_bytes()
+
+    def close(self):
+        """
+        Closing the database connection.
+
+        :return: None
+        """
+        self.connection.close()
+
+
+class FileMover:
+    """
+    Journaled planner for batched file moves.\n
+    All destinations are planned first, each destination folder is created
+    once and the files are moved with os.rename, optionally from a thread
+    pool. The plan is written to a journal before any file is moved and
+    the journal is removed when all moves are done, so an interrupted run
+    can be resumed or rolled back.
+    """
+    def __init__(self, journal):
+        """
+        :param journal: The path for the journal file
+        :type journal: str
+        """
+        self.journal = journal
+        self.moves = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, path, folder):
+        """
+        Planning to move a file into a folder.
+
+        :param path: The file path
+        :param folder: The destination folder
+        :type path: str
+        :type folder: str
+        :return: None
+        """
+        self.moves.append((path, folder + '/' + os.path.basename(path)))
+
+    def pending(self):
+        """
+        Checking for an unfinished journal.
+
+        :return: True if an interrupted run is found
+        :rtype: bool
+        """
+        return os.path.exists(self.journal)
+
+    def execute(self, threads=1):
+        """
+        Moving all planned files.\n
+        os.rename replaces existing files silently, so the plan is refused
+        and no file is moved if a destination exists or is planned twice.
+
+        :param threads: The number of threads for the moves
+        :type threads: int
+        :return: The number of moved files, None if the plan is refused
+        :rtype: int
+        """
+        if self.pending():
+            print('Error! Unfinished moves in {}, resume or roll back them '
+                  'first.'.format(self.journal))
+            return None
+        if not self.moves:
+            return 0
+        planned, conflicts = set(), []
+        for _, dst in self.moves:
+            if dst in planned or os.path.exists(dst):
+                conflicts.append(dst)
+            planned.add(dst)
+        if conflicts:
+            print('Error! {} destinations exist or are planned twice, e.g. {}, '
+                  'no file is moved.'.format(len(conflicts), conflicts[0]))
+            return None
+        for folder in {os.path.dirname(dst) for _, dst in self.moves}:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = self.journal + '.tmp'
+        with open(temp_path, 'w') as journal:
+            journal.writelines(
+                '{}\t{}\n'.format(src, dst) for src, dst in self.moves
+            )
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self.journal)
+        moved = self._run(self.moves, threads)
+        os.remove(self.journal)
+        self.moves = []
+        return moved
+
+    def resume(self, threads=1):
+        """
+        Finishing the moves of an interrupted run.
+
+        :param threads: The number of threads for the moves
+        :type threads: int
+        :return: The number of moved files
+        :rtype: int
+        """
+        moves = [(src, dst) for src, dst in self._read_journal()
+                 if os.path.exists(src)]
+        moved = self._run(moves, threads)
+        os.remove(self.journal)
+        return moved
+
+    def rollback(self, threads=1):
+        """
+        Moving the files of an interrupted run back to their origin paths.
+
+        :param threads: The number of threads for the moves
+        :type threads: int
+        :return: The number of moved files
+        :rtype: int
+        """
+        moves = [(dst, src) for src, dst in self._read_journal()
+                 if os.path.exists(dst) and not os.path.exists(src)]
+        moved = self._run(moves, threads)
+        os.remove(self.journal)
+        return moved
+
+    def _read_journal(self):
+        """
+        Reading the planned moves from the journal.
+
+        :return: The (source, destination) pairs
+        :rtype: list
+        """
+        if not self.pending():
+            return []
+        with open(self.journal, 'r') as journal:
+            return [tuple(line.rstrip('\n').split('\t')) for line in journal]
+
+    def _run(self, moves, threads=1):
+        """
+        Moving files, falling back to shutil.move across file systems.
+
+        :return: The number of moved files
+        :rtype: int
+        """
+        def move(pair):
+            try:
+                os.rename(pair[0], pair[1])
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise
+                shutil.move(pair[0], pair[1])
+        if threads == 1:
+            for pair in moves:
+                move(pair)
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(move, moves, chunksize=64))
+        return len(moves)
+
+
+class StructureStore:
+    """
+    Consolidated store of structures and energies in one folder.\n
+    Atomic numbers and coordinates of all molecules are appended to two
+    raw binary files and a small index (names, energies, start rows and
+    atom counts) is kept in index.npz. Structures are read through memory
+    maps, so random access by molecule name and iterating over the whole
+    set never load all coordinates into memory.
+    """
+    def __init__(self, path):
+        """
+        :param path: The store folder, created if it does not exist
+        :type path: str
+        """
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.numbers_path = path + '/numbers.bin'
+        self.xyz_path = path + '/coordinates.bin'
+        self.index_path = path + '/index.npz'
+        self.names, self.energies, self.starts, self.counts = [], [], [], []
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as index:
+                self.names = index['names'].tolist()
+                self.energies = index['energies'].tolist()
+                self.starts = index['starts'].tolist()
+                self.counts = index['counts'].tolist()
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        # Rows written after the last index update are unused
+        if os.path.exists(self.numbers_path):
+            self.rows = os.path.getsize(self.numbers_path) // 4
+        else:
+            self.rows = 0
+        self.numbers_file, self.xyz_file = None, None
+        self.numbers_map, self.xyz_map = None, None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __getitem__(self, name):
+        """
+        Reading one structure by molecule name.
+
+        :param name: The molecule name
+        :type name: str
+        :return: The energy and the GEOMETRY_DTYPE array
+        :rtype: tuple
+        """
+        i = self.positions[name]
+        return self.energies[i], self._read(self.starts[i], self.counts[i])
+
+    def __iter__(self):
+        """
+        Streaming (name, energy, geometry) of all structures in the order
+        they were appended.
+        """
+        for i, name in enumerate(self.names):
+            yield name, self.energies[i], self._read(
+                self.starts[i], self.counts[i]
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, name, energy, geometry):
+        """
+        Appending one structure. An existing entry with the same name is
+        replaced.
+
+        :param name: The molecule name
+        :param energy: The SCF energy in atom unit
+        :param geometry: The GEOMETRY_DTYPE array
+        :type name: str
+        :type energy: float
+        :type geometry: numpy.ndarray
+        :return: None
+        """
+        if self.numbers_file is None:
+            self.numbers_file = open(self.numbers_path, 'ab')
+            self.xyz_file = open(self.xyz_path, 'ab')
+        self.numbers_file.write(
+            np.ascontiguousarray(geometry['number'], dtype='<i4').tobytes()
+        )
+        self.xyz_file.write(
+            np.ascontiguousarray(geometry['xyz'], dtype='<f8').tobytes()
+        )
+        if name in self.positions:
+            i = self.positions[name]
+        else:
+            i = len(self.names)
+            self.positions[name] = i
+            self.names.append(name)
+            self.energies.append(None)
+            self.starts.append(None)
+            self.counts.append(None)
+        self.energies[i] = float(energy)
+        self.starts[i] = self.rows
+        self.counts[i] = len(geometry)
+        self.rows += len(geometry)
+        # The previous memory maps do not cover the new rows
+        self.numbers_map, self.xyz_map = None, None
+
+    def flush(self):
+        """
+        Writing the appended data and updating the index file.
+
+        :return: None
+        """
+        if self.numbers_file is not None:
+            self.numbers_file.close()
+            self.xyz_file.close()
+            self.numbers_file, self.xyz_file = None, None
+        # Appended rows are not visible in the previous memory maps
+        self.numbers_map, self.xyz_map = None, None
+        temp_path = self.path + '/index.tmp.npz'
+        np.savez(
+            temp_path, names=np.array(self.names, dtype=str),
+            energies=np.array(self.energies, dtype=np.float64),
+            starts=np.array(self.starts, dtype=np.int64),
+            counts=np.array(self.counts, dtype=np.int64)
+        )
+        os.replace(temp_path, self.index_path)
+
+    def close(self):
+        """
+        Flushing the store and releasing the memory maps.
+
+        :return: None
+        """
+        self.flush()
+
+    def _read(self, start, count):
+        """
+        Reading a geometry from the memory-mapped binary files.
+
+        :return: The GEOMETRY_DTYPE array
+        :rtype: numpy.ndarray
+        """
+        if self.numbers_map is None:
+            if self.rows == 0:
+                return np.empty(0, dtype=GEOMETRY_DTYPE)
+            # Buffered rows of appended structures
+            if self.numbers_file is not None:
+                self.numbers_file.flush()
+                self.xyz_file.flush()
+            self.numbers_map = np.memmap(
+                self.numbers_path, dtype='<i4', mode='r', shape=(self.rows,)
+            )
+            self.xyz_map = np.memmap(
+                self.xyz_path, dtype='<f8', mode='r', shape=(self.rows, 3)
+            )
+        geometry = np.empty(count, dtype=GEOMETRY_DTYPE)
+        geometry['number'] = self.numbers_map[start:start + count]
+        geometry['xyz'] = self.xyz_map[start:start + count]
+        return geometry
+
+
+class BatchProfile:
+    """
+    Per-phase timers and counters of a batch operation.\n
+    Phase times are exclusive, the time of a nested phase is not counted
+    in the outer phase, so lazily chained generators can be timed by
+    wrapping each stage with timed().
+    """
+    def __init__(self, operation, cprofile=False):
+        """
+        :param operation: The name of the batch operation
+        :param cprofile: Capturing a cProfile report of the operation
+        :type operation: str
+        :type cprofile: bool
+        """
+        self.operation = operation
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.profiler = cProfile.Profile() if cprofile else None
+        self.start = time.perf_counter()
+        self.total = None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Timing a phase of the operation.
+
+        :param name: The phase name, e.g. 'scan', 'parse' or 'move'
+        :type name: str
+        """
+        frame = [time.perf_counter(), 0.0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            self.timers[name] += elapsed - frame[1]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def timed(self, iterable, name):
+        """
+        Timing the time spent in producing the items of an iterable.
+
+        :param iterable: The iterable, usually a generator
+        :param name: The phase name
+        :type name: str
+        :return: Generator of the same items
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name, value=1):
+        """
+        Increasing a counter, e.g. 'files', 'bytes_parsed' or 'moves'.
+
+        :param name: The counter name
+        :param value: The increment
+        :type name: str
+        :type value: int
+        :return: None
+        """
+        self.counters[name] += value
+
+    def stop(self):
+        """
+        Stopping the timer and the cProfile capture.
+
+        :return: None
+        """
+        if self.total is None:
+            self.total = time.perf_counter() - self.start
+            if self.profiler is not None:
+                self.profiler.disable()
+
+    def summary(self):
+        """
+        Machine-readable summary of the operation.
+
+        :return: JSON serializable dictionary with the total time,
+        exclusive phase times, counters, files per second and the cProfile
+        report if captured
+        :rtype: dict
+        """
+        self.stop()
+        phases = dict(self.timers)
+        phases['other'] = max(0.0, self.total - sum(self.timers.values()))
+        summary = {
+            'operation': self.operation,
+            'started': datetime.fromtimestamp(
+                time.time() - self.total
+            ).isoformat(),
+            'total_time': self.total,
+            'phases': phases,
+            'counters': dict(self.counters),
+            'files_per_second': (self.counters['files'] / self.total
+                                 if self.total else 0.0)
+        }
+        if self.profiler is not None:
+            report = io.StringIO()
+            pstats.Stats(self.profiler, stream=report).sort_stats(
+                'cumulative'
+            ).print_stats(30)
+            summary['profile'] = report.getvalue()
+        return summary
 
 
 # noinspection PyMethodMayBeStatic
@@ -28,6 +1237,10 @@ class GaussianInout:
         self.gauss_method = method
         self.elements = {1: 'H', 6: 'C', 7: 'N', 8: 'O', 9: 'F', 15: 'P',
                          16: 'S', 17: 'Cl', 35: 'Br', 53: 'I'}
+        # Element symbols indexed by atomic number
+        self.element_table = np.zeros(119, dtype='<U2')
+        for number, symbol in self.elements.items():
+            self.element_table[number] = symbol
         self.mol_name = '{}_{}'.format(mol, seq)
         # Gaussian16 header and barkla bash template
         self.header = './header_{}'.format(method)
@@ -37,6 +1250,8 @@ class GaussianInout:
         # Gaussian16 input and output folder
         self.input_folder = '{}/input_{}/{}'.format(
             root_path, method, self.mol_name)
+        # Journal of generated input files for incremental preparation
+        self.prep_manifest = self.input_folder + '/.prep_manifest'
         self.output_folder = '{}/output_{}/{}'.format(
             root_path, method, self.mol_name)
         self.origin_result_folder = ('{}/result'.format(self.output_folder))
@@ -44,8 +1259,14 @@ class GaussianInout:
         self.normal_result_folder = (
                 self.output_folder + '/{}_out'.format(self.mol_name)
         )
+        # Journal for interrupted file moves
+        self.move_journal = self.output_folder + '/.move_journal'
         # Molecule structure folder
         self.mol_result = self.output_folder + '/{}_xyz'.format(self.mol_name)
+        # Consolidated structure store
+        self.structure_store = (
+                self.output_folder + '/{}_store'.format(self.mol_name)
+        )
         self.chk_path = (
             '%Chk=/users/psyche/volatile/gaussian/chk/{}/'.format(method)
         )
@@ -57,6 +1278,14 @@ class GaussianInout:
             os.makedirs(self.normal_result_folder)
         if not os.path.exists(self.mol_result):
             os.makedirs(self.mol_result)
+        # Output parser engine, 'stream' or 'mmap'
+        self.engine = 'stream'
+        # Profiling of the last batch operation
+        self.profile = BatchProfile('init')
+        self.cprofile = False
+        self.profile_log = None
+        # Parsed results cache for re-running the screening
+        self.cache = ParseCache(self.output_folder + '/.parse_cache.sqlite')
 
     def setup_result_folder(self, folder):
         """
@@ -78,6 +1307,80 @@ class GaussianInout:
         """
         self.chk_path = chk_path
 
+    def setup_engine(self, engine):
+        """
+        Choosing the output parser engine.
+
+        :param engine: 'stream' for reading line by line or 'mmap' for
+        scanning the memory-mapped files with byte patterns, which is faster
+        for large output files
+        :type engine: str
+        :return: None
+        """
+        if engine not in ['stream', 'mmap']:
+            print('Error! The engine must be stream or mmap.')
+            return
+        self.engine = engine
+
+    def setup_cache(self, enable=True, max_size=512):
+        """
+        Enabling or disabling the parsed results cache.
+
+        :param enable: Using the cache under self.output_folder
+        :param max_size: The size cap of all cached records in MB
+        :type enable: bool
+        :type max_size: int
+        :return: None
+        """
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if enable:
+            self.cache = ParseCache(
+                self.output_folder + '/.parse_cache.sqlite', max_size
+            )
+
+    def setup_profiling(self, cprofile=False, log=None):
+        """
+        Configuring the profiling of batch operations. Every operation
+        returns its summary dictionary and the summary is also appended as
+        one JSON line to the log file, so performance can be tracked across
+        runs.
+
+        :param cprofile: Adding a cProfile report into the summary
+        :param log: The path for the JSON lines log file, None for no log
+        :type cprofile: bool
+        :type log: str
+        :return: None
+        """
+        self.cprofile = cprofile
+        self.profile_log = log
+
+    def _start_profile(self, operation):
+        """
+        Starting the profile of a batch operation.
+
+        :param operation: The operation name
+        :type operation: str
+        :return: The new profile
+        :rtype: BatchProfile
+        """
+        self.profile = BatchProfile(operation, self.cprofile)
+        return self.profile
+
+    def _finish_profile(self):
+        """
+        Finishing the profile of the current batch operation.
+
+        :return: The profiling summary
+        :rtype: dict
+        """
+        summary = self.profile.summary()
+        if self.profile_log is not None:
+            with open(self.profile_log, 'a') as log:
+                log.write(json.dumps(summary) + '\n')
+        return summary
+
     def info(self, info):
         """
         Print variables for different function.
@@ -124,122 +1427,173 @@ class GaussianInout:
                 'error_input.'
             )
 
-    def prep_input(self, geometry):
+    def prep_input(self, geometry, workers=1, threads=1, incremental=False):
         """
         Generate gaussian input files.\n
         All chemical files must be stored under self.input_folder.\n
         Header information is read from self.header file.\n
         Checkpoint file path is read from self.chk_path variable and named
-        as same as the molecule file.
+        as same as the molecule file.\n
+        The size and modification time of each molecule file and a hash of
+        the header, checkpoint line and geometry mode are journaled in
+        self.prep_manifest after every written batch. The incremental mode
+        only writes input files which are missing or out of date, so an
+        interrupted run can be resumed.
 
-        :return: None
+        :param geometry: One of 'local' and 'chk'
+        :param workers: The number of processes for reading molecule files,
+        None for all CPU cores
+        :param threads: The number of threads for writing input files
+        :param incremental: Skipping up-to-date input files
+        :type geometry: str
+        :type workers: int
+        :type threads: int
+        :type incremental: bool
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         print('Processing...')
         start = datetime.now()
+        profile = self._start_profile('prep_input')
         # Create folders for origin Gaussian input files
         input_origin_folder = self.input_folder + '/{}'.format(self.mol_name)
         if not os.path.exists(input_origin_folder):
             os.makedirs(input_origin_folder)
+        if geometry not in ['local', 'chk']:
+            print('Error! Geometry must be local or chk.')
         with open(self.header, 'r') as header:
-            template = header.readlines()
+            header_lines = header.readlines()
+        template = InputTemplate(header_lines, self.chk_path, geometry)
+        digest = hashlib.sha1(
+            ''.join(header_lines + [self.chk_path, geometry]).encode()
+        ).hexdigest()
+        manifest = self._read_manifest()
+        existing = {entry.name for entry in scan_files(input_origin_folder)}
+        keys = {}
+        counts = {'created': 0, 'skipped': 0, 'rewritten': 0}
+
+        def not_supported(entry):
+            print('Waring!\n'
+                  '{} is not MOL or XYZ format!'.format(entry.name))
+
+        def pending_files():
+            suffix = ('.mol', '.xyz') if geometry == 'local' else None
+            entries = scan_files(self.mol_origin, suffix, not_supported)
+            for entry in profile.timed(entries, 'scan'):
+                name = entry.name.split('.')[0]
+                stat = entry.stat()
+                key = '{}\t{}\t{}'.format(
+                    stat.st_size, stat.st_mtime_ns, digest
+                )
+                if name + '.gjf' in existing:
+                    if incremental and manifest.get(name) == key:
+                        counts['skipped'] += 1
+                        continue
+                    counts['rewritten'] += 1
+                else:
+                    counts['created'] += 1
+                keys[name] = key
+                yield entry.name
         # Generate Gaussian input data for all molecules
-        for file in os.listdir(self.mol_origin):
-            input_data = template.copy()
-            # Get the molecular name
-            name = file.split('.')[0]
-            # Edit the checkpoint line
-            for i in range(len(input_data)):
-                if input_data[i].startswith('%Chk'):
-                    input_data[i] = self.chk_path + '{}.chk\n'.format(name)
-            # Read molecule file
-            if geometry == 'local':
-                molecular_file = self.mol_origin + '/' + file
-                with open(molecular_file, 'r') as data:
-                    # Get all atoms coordinates
-                    # Mol format
-                    if file.endswith('.mol'):
-                        for line in data:
-                            segments = re.split(r'\s+', line)
-                            try:
-                                if segments[4] in self.elements.values():
-                                    xyz_line = '{}{:>14}{:>14}{:>14}\n'.format(
-                                        segments[4],
-                                        segments[1],
-                                        segments[2],
-                                        segments[3]
-                                    )
-                                    input_data.append(xyz_line)
-                            except IndexError:
-                                pass
-                    # XYZ format
-                    elif file.endswith('.xyz'):
-                        for line in data:
-                            try:
-                                if line[0].isalpha():
-                                    input_data.append(line)
-                            except IndexError:
-                                pass
-                    else:
-                        print('Waring!\n'
-                              '{} is not MOL or XYZ format!'.format(file))
-                        break
-                # Adding terminate line
-                input_data.append('\n')
-            elif geometry == 'chk':
-                geom_line = False
-                for line in input_data:
-                    if line.startswith('# Geom'):
-                        geom_line = True
-                if not geom_line:
-                    input_data.insert(4, '# Geom=Checkpoint Guess=Read\n')
-            else:
-                print('Error! Geometry must be local or chk.')
-            # Writing data into a gjf file
-            input_path = '{}/{}.gjf'.format(input_origin_folder, name)
-            with open(input_path, 'w') as input_file:
-                input_file.writelines(input_data)
-        print('Finished. Total time:{}'.format(datetime.now() - start))
+        render = partial(
+            _render_gjf, mol_origin=self.mol_origin,
+            input_folder=input_origin_folder, template=template,
+            symbols=set(self.elements.values())
+        )
+        inputs = profile.timed(
+            parallel_imap(render, pending_files(), workers, 64), 'render'
+        )
+        with open(self.prep_manifest, 'a') as journal:
+            def record(paths):
+                for path in paths:
+                    name = os.path.basename(path)[:-4]
+                    manifest[name] = keys[name]
+                    journal.write('{}\t{}\n'.format(name, keys[name]))
+                journal.flush()
+            with profile.phase('write'):
+                profile.count(
+                    'files', write_files(inputs, threads, callback=record)
+                )
+        self._write_manifest(manifest)
+        print(
+            'Finished.\n'
+            'Created input files:    {}\n'
+            'Rewritten input files:  {}\n'
+            'Skipped input files:    {}\n'
+            'Total time:{}'.format(counts['created'], counts['rewritten'],
+                                   counts['skipped'], datetime.now() - start)
+        )
+        profile.count('skipped', counts['skipped'])
+        return self._finish_profile()
 
-    def error_screening(self):
+    def _read_manifest(self):
+        """
+        Reading the input files manifest, later lines replace earlier ones.
+
+        :return: The molecule names and their source keys
+        :rtype: dict
+        """
+        manifest = {}
+        if os.path.exists(self.prep_manifest):
+            with open(self.prep_manifest, 'r') as journal:
+                for line in journal:
+                    name, _, key = line.rstrip('\n').partition('\t')
+                    if key.count('\t') == 2:
+                        manifest[name] = key
+        return manifest
+
+    def _write_manifest(self, manifest):
+        """
+        Compacting the input files manifest.
+
+        :param manifest: The molecule names and their source keys
+        :type manifest: dict
+        :return: None
+        """
+        temp_path = self.prep_manifest + '.tmp'
+        with open(temp_path, 'w') as journal:
+            journal.writelines(
+                '{}\t{}\n'.format(name, key) for name, key in manifest.items()
+            )
+        os.replace(temp_path, self.prep_manifest)
+
+    def error_screening(self, workers=1, threads=1):
         """
         Checking the output files and distributing unfinished amd error files
         into different folder.\n
         Error folders are automatically created and named by the error type.
 
-        :return: None
+        :param workers: The number of processes, None for all CPU cores
+        :param threads: The number of threads for moving files
+        :type workers: int
+        :type threads: int
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         # Checking the error for output files
         print('Targeted folder: {}'.format(self.origin_result_folder))
         start = datetime.now()
+        profile = self._start_profile('error_screening')
         i, j = 0, 0
         error_type = []
-        for file in os.listdir(self.origin_result_folder):
-            if not file.endswith('.out'):
-                print('Error!\n{} is not a Gaussian out file!'.format(file))
-                break
-            path = self.origin_result_folder + '/' + file
-            with open(path, 'r') as gauss_out:
-                lines = gauss_out.readlines()
-                # Checking the ending line
-                if not re.match(r' File| Normal', lines[-1]):
-                    unfinished = self.output_folder + '/unfinished'
-                    if not os.path.exists(unfinished):
-                        os.mkdir(unfinished)
-                    shutil.move(path, unfinished)
-                    i += 1
-                else:
-                    error_line = lines[-4:-3][0]
-                    # Checking the error indicator
-                    if error_line.startswith(' Error termination'):
-                        error = re.split(r'[/.]', error_line)[-3][1:]
-                        if error not in error_type:
-                            error_type.append(error)
-                        # Creating a new folder for different error type
-                        error_folder = self.output_folder + '/error_' + error
-                        if not os.path.exists(error_folder):
-                            os.mkdir(error_folder)
-                        shutil.move(path, error_folder)
-                        j += 1
+        entries = self._out_files(self.origin_result_folder)
+        mover = FileMover(self.move_journal)
+        for path, result in self._iter_results(entries, workers, True):
+            status, error = result.status, result.error
+            if status == 'unfinished':
+                mover.add(path, self.output_folder + '/unfinished')
+                i += 1
+            elif status == 'error':
+                if error not in error_type:
+                    error_type.append(error)
+                # Different folders for different error type
+                mover.add(path, self.output_folder + '/error_' + error)
+                j += 1
+        with profile.phase('move'):
+            moved = mover.execute(threads)
+        if moved is None:
+            return self._finish_profile()
+        profile.count('moves', moved)
         print(
             'Finished.\n'
             'Unfinished:             {}\n'
@@ -247,196 +1601,613 @@ class GaussianInout:
             'Error categories:       {}\n'
             'Total time:{}'.format(i, j, error_type, (datetime.now() - start))
         )
+        return self._finish_profile()
 
-    def neg_freq_screening(self):
+    def neg_freq_screening(self, workers=1, threads=1):
         """
         Checking the frequency information and distributing negative frequency
         output files into 'neg_freq' folder.
 
-        :return: None
+        :param workers: The number of processes, None for all CPU cores
+        :param threads: The number of threads for moving files
+        :type workers: int
+        :type threads: int
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         print('Targeted folder: {}'.format(self.origin_result_folder))
         start = datetime.now()
+        profile = self._start_profile('neg_freq_screening')
         i, j = 0, 0
-        for file in os.listdir(self.origin_result_folder):
-            if not file.endswith('.out'):
-                print('Error!\n{} is not a Gaussian out file!'.format(file))
-                break
-            path = self.origin_result_folder + '/' + file
-            with open(path, 'r') as gauss_out:
-                for line in gauss_out:
-                    # Checking the frequencies
-                    if line.startswith(' Frequencies'):
-                        data = re.split(r'\s+', line)
-                        # Normal terminated jobs
-                        if float(data[3]) > 0:
-                            shutil.move(path, self.normal_result_folder)
-                            i += 1
-                            break
-                        # Negative frequencies
-                        elif float(data[3]) < 0:
-                            neg_folder = self.output_folder + '/neg_freq'
-                            if not os.path.exists(neg_folder):
-                                os.mkdir(neg_folder)
-                            shutil.move(path, neg_folder)
-                            j += 1
-                            break
+        entries = self._out_files(self.origin_result_folder)
+        mover = FileMover(self.move_journal)
+        for path, result in self._iter_results(entries, workers):
+            frequency = result.lowest_freq
+            if frequency is None:
+                continue
+            # Normal terminated jobs
+            if frequency > 0:
+                mover.add(path, self.normal_result_folder)
+                i += 1
+            # Negative frequencies
+            else:
+                mover.add(path, self.output_folder + '/neg_freq')
+                j += 1
+        with profile.phase('move'):
+            moved = mover.execute(threads)
+        if moved is None:
+            return self._finish_profile()
+        profile.count('moves', moved)
         print(
             'Finished.\n'
             'Normal results:            {}\n'
             'Negative frequency result: {}\n'
             'Total time:{}'.format(i, j, (datetime.now() - start))
         )
+        return self._finish_profile()
 
     def prep_error_input(self, error):
         """
         Generating input files for error and negative frequency results.
         Using prepared header information.
 
-        :return: None
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         error_folder = self.output_folder + '/{}'.format(error)
         print('Targeted folder: {}'.format(error_folder))
         start = datetime.now()
-        error_list = os.listdir(error_folder)
+        profile = self._start_profile('prep_error_input')
         with open(self.header, 'r') as header:
-            template = header.readlines()
-        for file in error_list:
-            input_data = template.copy()
-            name = file.split('.')[0]
-            geom_line = False
-            # Edit checkpoint line
-            for i in range(len(input_data)):
-                if input_data[i].startswith('%Chk'):
-                    input_data[i] = self.chk_path + '{}.chk\n'.format(name)
-                elif input_data[i].startswith('# Geom'):
-                    geom_line = True
-            if not geom_line:
-                input_data.insert(4, '# Geom=Checkpoint Guess=Read\n')
-            # Creating folder and writing the input files
-            error_input_folder = (self.input_folder + '/{}'.format(error))
-            if not os.path.exists(error_input_folder):
-                os.mkdir(error_input_folder)
-            error_input_file = error_input_folder + '/{}.gjf'.format(name)
-            with open(error_input_file, 'w') as input_file:
-                input_file.writelines(input_data)
+            template = InputTemplate(header.readlines(), self.chk_path, 'chk')
+        # Creating folder and writing the input files
+        error_input_folder = (self.input_folder + '/{}'.format(error))
+        if not os.path.exists(error_input_folder):
+            os.mkdir(error_input_folder)
+        names = (entry.name.split('.')[0] for entry in
+                 profile.timed(scan_files(error_folder), 'scan'))
+        with profile.phase('write'):
+            profile.count('files', write_files(
+                ('{}/{}.gjf'.format(error_input_folder, name),
+                 template.render(name)) for name in names
+            ))
         print(
             'Finished.\n'
             'Total time:{}'.format(datetime.now() - start)
         )
+        return self._finish_profile()
 
-    def files_distribution(self, path, number):
+    def files_distribution(self, path, number, threads=1, balance=None):
         """
         Distributed files into sub folders that can be applied for array jobs on
-        barkla.
+        barkla.\n
+        The first sub-folder also takes the remainder files.\n
+        With a balance mode the files are not moved. They are bin-packed into
+        the same number of shards with balanced total cost and written into
+        a shard index next to the root folder (see prep_array_job). The cost
+        of an input is estimated by:\n
+        'atoms': the cube of the atom count in the gjf file\n
+        'size': the file size\n
+        'runtime': the wall time of an earlier output file with the same name
+        under self.output_folder, inputs without output use the mean time
 
         :param path: The root folder
         :param number: The number of files in each sub-folders
+        :param threads: The number of threads for moving files
+        :param balance: None, 'atoms', 'size' or 'runtime'
         :type path: str
         :type number: int
-        :return: None
+        :type threads: int
+        :type balance: str
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         print('Starting...')
-        n, i = 0, 1
+        profile = self._start_profile('files_distribution')
         if not path.endswith('/'):
             path = path + '/'
-        j = len(os.listdir(path)) % number
-        for file in os.listdir(path):
-            root_path = path + file
-            sub_array_path = path + str(i)
-            if not os.path.exists(sub_array_path):
-                os.mkdir(sub_array_path)
-            shutil.move(root_path, sub_array_path)
-            n += 1
-            if (n == number and i != 1) or (n == (number + j) and i == 1):
-                n = 0
-                i += 1
+        files = [entry.name for entry in
+                 profile.timed(scan_files(path), 'scan')]
+        profile.count('files', len(files))
+        if balance is not None:
+            with profile.phase('plan'):
+                plan = self._plan_shards(path, files, number, balance)
+            if plan is None:
+                return self._finish_profile()
+            shards, totals = plan
+            with profile.phase('write'):
+                index, _ = self._write_shards(path, shards)
+            print(
+                'Finished!\n'
+                'Distributed into {} shards.\n'
+                'Shard cost range: {:.4g} - {:.4g}\n'
+                'Shard manifest:   {}'.format(
+                    len(shards), min(totals), max(totals), index
+                )
+            )
+            return self._finish_profile()
+        i, j = 0, len(files) % number
+        mover = FileMover(self.move_journal)
+        for k, file in enumerate(files):
+            if k < number + j:
+                i = 1
+            else:
+                i = 2 + (k - number - j) // number
+            mover.add(path + file, path + str(i))
+        with profile.phase('move'):
+            moved = mover.execute(threads)
+        if moved is None:
+            return self._finish_profile()
+        profile.count('moves', moved)
         print('Finished!\n'
-              'Distributed into {} folders.'.format((i - 1)))
+              'Distributed into {} folders.'.format(i))
+        return self._finish_profile()
+
+    def _plan_shards(self, path, files, number, balance=None):
+        """
+        Grouping files into shards. Without balance mode the first shard
+        takes the remainder files as same as files_distribution, otherwise
+        the shards are balanced by the estimated cost of each file.
 
-    def files_redistribution(self, path):
+        :param path: The root folder ending with '/'
+        :param files: The file names
+        :param number: The number of files in each shard
+        :param balance: None, 'atoms', 'size' or 'runtime'
+        :type path: str
+        :type files: list
+        :type number: int
+        :type balance: str
+        :return: The file names and the total cost of each shard, None if
+        the balance mode is not supported
+        :rtype: tuple
+        """
+        n_shards = max(1, len(files) // number)
+        if balance is None:
+            j = len(files) % number
+            shards = [files[:number + j]] + [
+                files[k:k + number]
+                for k in range(number + j, len(files), number)
+            ]
+            return shards, [len(shard) for shard in shards]
+        if balance == 'atoms':
+            costs = [gjf_atoms(path + file) ** 3 for file in files]
+        elif balance == 'size':
+            costs = [os.path.getsize(path + file) for file in files]
+        elif balance == 'runtime':
+            outputs = {}
+            for folder, _, _ in os.walk(self.output_folder):
+                for entry in scan_files(folder, '.out'):
+                    outputs[entry.name[:-4]] = entry
+            names = [file.split('.')[0] for file in files]
+            known = [name for name in names if name in outputs]
+            results = self._parse_outputs([outputs[name] for name in known])
+            runtimes = {name: result.wall_time
+                        for name, result in zip(known, results)
+                        if result.wall_time is not None}
+            default = (sum(runtimes.values()) / len(runtimes)
+                       if runtimes else 1)
+            costs = [runtimes.get(name, default) for name in names]
+        else:
+            print('Error! The balance must be atoms, size or runtime.')
+            return None
+        groups = balance_shards(costs, n_shards)
+        return ([[files[i] for i in group] for group in groups],
+                [sum(costs[i] for i in group) for group in groups])
+
+    def _write_shards(self, path, shards):
+        """
+        Writing the shard index next to the root folder, one line per shard
+        with the tab separated file names. A second file keeps the byte
+        offset of each line as fixed width records, so a shard can be read
+        by seeking without scanning the index.
+
+        :param path: The root folder ending with '/'
+        :param shards: The file names of each shard
+        :type path: str
+        :type shards: list
+        :return: The index and offsets file paths
+        :rtype: tuple
+        """
+        index = path[:-1] + '.shards'
+        offsets = index + '.offsets'
+        position = 0
+        with open(index, 'wb') as index_file, \
+                open(offsets, 'wb') as offsets_file:
+            for shard in shards:
+                line = ('\t'.join(shard) + '\n').encode()
+                index_file.write(line)
+                offsets_file.write('{:020d}\n'.format(position).encode())
+                position += len(line)
+        return index, offsets
+
+    def files_redistribution(self, path, threads=1):
         """
         Collecting all sub-folders files to their root folder.
 
         :param path: The root folder
+        :param threads: The number of threads for moving files
         :type path: str
-        :return: None
+        :type threads: int
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
+        profile = self._start_profile('files_redistribution')
         if not path.endswith('/'):
             path = path + '/'
-        for folder in os.listdir(path):
-            file_list = os.listdir(path + str(folder))
-            for file in file_list:
-                target_path = '{}/{}/{}'.format(path, folder, file)
-                shutil.move(target_path, path)
-            os.removedirs(path + str(folder))
+        with os.scandir(path) as entries:
+            folders = [entry.path for entry in entries if entry.is_dir()]
+        mover = FileMover(self.move_journal)
+        for folder in folders:
+            for entry in profile.timed(scan_files(folder), 'scan'):
+                profile.count('files')
+                mover.add(entry.path, path[:-1])
+        with profile.phase('move'):
+            moved = mover.execute(threads)
+        if moved is None:
+            return self._finish_profile()
+        profile.count('moves', moved)
+        for folder in folders:
+            os.rmdir(folder)
         print('Finished!')
+        return self._finish_profile()
+
+    def prep_array_job(self, path, number, balance=None):
+        """
+        Generating a shard index and a bash array job script for the files
+        in the root folder without moving any file.\n
+        Each array task seeks its line in the index by SLURM_ARRAY_TASK_ID
+        through the fixed width offsets file. The lines of self.bash before
+        the first command are kept as the job header with a new '--array'
+        option and the rest of the template is run once for each input
+        file, with $INPUT set to the file path and $NAME to the molecule
+        name.
+
+        :param path: The root folder
+        :param number: The number of files in each shard
+        :param balance: None, 'atoms', 'size' or 'runtime', see
+        files_distribution
+        :type path: str
+        :type number: int
+        :type balance: str
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
+        """
+        print('Starting...')
+        profile = self._start_profile('prep_array_job')
+        if not path.endswith('/'):
+            path = path + '/'
+        files = [entry.name for entry in
+                 profile.timed(scan_files(path), 'scan')]
+        profile.count('files', len(files))
+        with profile.phase('plan'):
+            plan = self._plan_shards(path, files, number, balance)
+        if plan is None:
+            return self._finish_profile()
+        shards, _ = plan
+        with profile.phase('write'):
+            index, offsets = self._write_shards(path, shards)
+        with open(self.bash, 'r') as bash:
+            template = bash.readlines()
+        header, body = [], []
+        for line in template:
+            if not body and (line.startswith('#') or not line.strip()):
+                if not line.startswith('#SBATCH --array'):
+                    header.append(line)
+            else:
+                body.append(line)
+        while header and not header[-1].strip():
+            header.pop()
+        script = path[:-1] + '_array.sh'
+        with open(script, 'w') as script_file:
+            script_file.writelines(header)
+            script_file.write(
+                '#SBATCH --array=1-{}\n\n'
+                'INPUT_DIR={}\n'
+                'SHARD_INDEX={}\n'
+                'SHARD_OFFSETS={}\n'
+                '# Seeking the index line of this task\n'
+                'OFFSET=$(dd if="$SHARD_OFFSETS" bs=21 count=1 '
+                'skip=$((SLURM_ARRAY_TASK_ID - 1)) 2>/dev/null)\n'
+                "IFS=$'\\t' read -r -a INPUTS < "
+                '<(tail -c +$((10#$OFFSET + 1)) "$SHARD_INDEX" | head -n 1)\n'
+                'for FILE in "${{INPUTS[@]}}"; do\n'
+                'INPUT="$INPUT_DIR/$FILE"\n'
+                'NAME="${{FILE%.*}}"\n'.format(
+                    len(shards), os.path.abspath(path),
+                    os.path.abspath(index), os.path.abspath(offsets)
+                )
+            )
+            script_file.writelines(body)
+            script_file.write('done\n')
+        os.chmod(script, 0o755)
+        print(
+            'Finished!\n'
+            'Array tasks:  {}\n'
+            'Shard index:  {}\n'
+            'Array script: {}'.format(len(shards), index, script)
+        )
+        return self._finish_profile()
+
+    def resume_moves(self, threads=1):
+        """
+        Finishing the file moves of an interrupted screening or distribution.
 
-    def obtain_structure(self):
+        :param threads: The number of threads for moving files
+        :type threads: int
+        :return: None
+        """
+        mover = FileMover(self.move_journal)
+        if not mover.pending():
+            print('No unfinished moves.')
+            return
+        print('Finished!\n'
+              'Moved files: {}'.format(mover.resume(threads)))
+
+    def rollback_moves(self, threads=1):
+        """
+        Moving the files of an interrupted screening or distribution back to
+        their origin folders.
+
+        :param threads: The number of threads for moving files
+        :type threads: int
+        :return: None
+        """
+        mover = FileMover(self.move_journal)
+        if not mover.pending():
+            print('No unfinished moves.')
+            return
+        print('Finished!\n'
+              'Restored files: {}'.format(mover.rollback(threads)))
+
+    def obtain_structure(self, workers=1, store='xyz'):
         """
         Obtain the final structure for  geometry optimisation result. The
         formation energy is written in the second line as atom unit and saved
-        as an XYZ format file.
+        as an XYZ format file.\n
+        With store='store' all structures and energies are appended into the
+        consolidated self.structure_store instead of thousands of XYZ files.
+        Molecules already in the store are not appended again, with 'store'
+        their output files are not parsed either.
 
-        :return: None
+        :param workers: The number of processes, None for all CPU cores
+        :param store: One of 'xyz', 'store' and 'both'
+        :type workers: int
+        :type store: str
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
         """
         print('Start...')
-        for out_file in os.listdir(self.normal_result_folder):
-            final_step_line, energy_line = 0, 0
-            first_atom_line, last_atom_line = 0, 0
-            out_file_path = self.normal_result_folder + '/' + out_file
-            with open(out_file_path, 'r') as file:
-                lines = file.readlines()
-            # Finding the converged step position
-            for i in range(len(lines)):
-                if lines[i].startswith(' Optimization completed'):
-                    final_step_line = i
-                    break
-            # Finding the energy and all coordinates position
-            for j in range(final_step_line - 1, -1, -1):
-                if 'SCF Done' in lines[j]:
-                    energy_line = j
-                if 'Coordinates (Angstroms)' in lines[j]:
-                    first_atom_line = j + 3
-                    for k in range(first_atom_line, final_step_line):
-                        if lines[k].startswith(' -'):
-                            last_atom_line = k - 1
-                            break
-                    break
-            # Reading the energy data
-            energy_str = re.split(r'\s+', lines[energy_line])[5]
-            if 'E' in energy_str:
-                energy_e = energy_str.split('E')
-                energy = float(energy_e[0]) * 10 ** int(energy_e[1])
-            else:
-                energy = energy_str
-            # Reading the last atom
-            atom_numbers = re.split(r'\s+', lines[last_atom_line])[1]
-            # Reading and adding coordinates data into the list
-            coordinate_lines = []
-            for n in range(first_atom_line, last_atom_line+1):
-                segments = re.split(r'\s+', lines[n])
-                coordinate_line = '{}{:>14}{:>14}{:>14}\n'.format(
-                    # Element
-                    self.elements[int(segments[2])],
-                    # X, Y, Z coordinates
-                    segments[4],
-                    segments[5],
-                    segments[6]
-                )
-                coordinate_lines.append(coordinate_line)
-            # xyz format lines list
-            name = out_file.split('.')[0]
-            xyz_title_lines = ['{}\n'.format(atom_numbers),
-                               '{} Energy: {} A.U.\n'.format(name, energy)]
-            xyz_format_lines = xyz_title_lines + coordinate_lines
+        if store not in ['xyz', 'store', 'both']:
+            print('Error! The store must be xyz, store or both.')
+            return None
+        profile = self._start_profile('obtain_structure')
+        structures = None
+        if store in ['store', 'both']:
+            structures = StructureStore(self.structure_store)
+        entries = (
+            entry for entry in self._out_files(self.normal_result_folder)
+            if store != 'store' or entry.name.split('.')[0] not in structures
+        )
+        for path, result in self._iter_results(entries, workers):
+            name = os.path.basename(path).split('.')[0]
+            if result.geometry is None:
+                print('Warning! {} has no optimised structure.'.format(name))
+                continue
+            if structures is not None and name not in structures:
+                with profile.phase('write'):
+                    structures.append(
+                        name, float(result.energy), result.geometry
+                    )
+            if store == 'store':
+                continue
+            symbols = self.element_table[result.geometry['number']]
+            if (symbols == '').any():
+                print('Warning! {} has unknown elements.'.format(name))
+                continue
+            # xyz format title lines and coordinates
+            title = '{}\n{} Energy: {} A.U.'.format(
+                result.n_atoms, name, energy_value(result.energy)
+            )
+            xyz = result.geometry['xyz']
+            rows = np.rec.fromarrays(
+                [symbols, xyz[:, 0], xyz[:, 1], xyz[:, 2]]
+            )
             path = self.mol_result + '/{}.xyz'.format(name)
-            with open(path, 'w') as mol_file:
-                mol_file.writelines(xyz_format_lines)
+            with profile.phase('write'):
+                np.savetxt(path, rows, fmt='%s%14.6f%14.6f%14.6f',
+                           header=title, comments='')
+            profile.count('structures')
+        print('Finished.')
+        if structures is not None:
+            structures.close()
+            print('Structure store:      {}'.format(self.structure_store))
+        if store != 'store':
+            print('XYZ format files in:  {}'.format(self.mol_result))
+        return self._finish_profile()
+
+    def export_table(self, path=None, workers=1, chunk_size=10000):
+        """
+        Exporting all normal terminated results under self.output_folder
+        into a Parquet table with the columns name, energy (A.U.),
+        lowest_freq, n_atoms, status and wall_time (seconds). The energy is
+        the energy of the optimised structure or the last SCF energy. Rows
+        are streamed and written in chunks, which can be loaded by
+        MdsPlot.data_retrieve.
+
+        :param path: The Parquet file path, default is
+        self.output_folder/<molecule>_results.parquet
+        :param workers: The number of processes, None for all CPU cores
+        :param chunk_size: The number of rows in each written chunk
+        :type path: str
+        :type workers: int
+        :type chunk_size: int
+        :return: The profiling summary, see setup_profiling
+        :rtype: dict
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        print('Start...')
+        start = datetime.now()
+        profile = self._start_profile('export_table')
+        if path is None:
+            path = self.output_folder + '/{}_results.parquet'.format(
+                self.mol_name
+            )
+        schema = pa.schema([
+            ('name', pa.string()),
+            ('energy', pa.float64()),
+            ('lowest_freq', pa.float64()),
+            ('n_atoms', pa.int32()),
+            ('status', pa.string()),
+            ('wall_time', pa.float64())
+        ])
+        entries = (entry for folder, _, _ in os.walk(self.output_folder)
+                   for entry in scan_files(folder, '.out'))
+        rows = 0
+        columns = {field: [] for field in schema.names}
+        with pq.ParquetWriter(path, schema) as writer:
+            for out_path, result in self._iter_results(entries, workers):
+                if result.status != 'normal':
+                    continue
+                energy = result.energy
+                if energy is None and result.scf_energies:
+                    energy = result.scf_energies[-1]
+                columns['name'].append(
+                    os.path.basename(out_path).split('.')[0]
+                )
+                columns['energy'].append(
+                    float(energy) if energy is not None else None
+                )
+                columns['lowest_freq'].append(result.lowest_freq)
+                columns['n_atoms'].append(result.n_atoms)
+                columns['status'].append(result.status)
+                columns['wall_time'].append(result.wall_time)
+                if len(columns['name']) >= chunk_size:
+                    rows += len(columns['name'])
+                    with profile.phase('write'):
+                        writer.write_table(pa.table(columns, schema=schema))
+                    columns = {field: [] for field in schema.names}
+            if columns['name']:
+                rows += len(columns['name'])
+                with profile.phase('write'):
+                    writer.write_table(pa.table(columns, schema=schema))
         print(
             'Finished.\n'
-            'XYZ format files in:  {}'.format(self.mol_result)
+            'Exported results:     {}\n'
+            'Results table:        {}\n'
+            'Total time:{}'.format(rows, path, datetime.now() - start)
         )
+        profile.count('rows', rows)
+        return self._finish_profile()
+
+    def load_structures(self):
+        """
+        Opening the consolidated structure store for reading.
+
+        :return: The store supporting store[name], len() and iteration
+        :rtype: StructureStore
+        """
+        return StructureStore(self.structure_store)
+
+    def read_geometry(self, name):
+        """
+        Reading the final structure of a normal terminated result as a NumPy
+        structured array for downstream analysis.
+
+        :param name: The molecule name of the Gaussian out file
+        :type name: str
+        :return: Array with 'number' (atomic number) and 'xyz' (Angstrom)
+        fields, None if the result has no optimised structure
+        :rtype: numpy.ndarray
+        """
+        path = self.normal_result_folder + '/{}.out'.format(name)
+        return self._parse_outputs([path])[0].geometry
+
+    def _parse_outputs(self, paths, workers=1, tail_only=False):
+        """
+        Parsing Gaussian out files into GaussianResult records.
+
+        :param paths: The paths for Gaussian out files
+        :param workers: The number of processes, None for all CPU cores
+        :param tail_only: Only checking the termination lines
+        :type paths: list
+        :type workers: int
+        :type tail_only: bool
+        :return: The records in the order of paths
+        :rtype: list
+        """
+        return [result for _, result in
+                self._iter_results(paths, workers, tail_only)]
+
+    def _iter_results(self, entries, workers=1, tail_only=False,
+                      chunk_size=256):
+        """
+        Streaming Gaussian out files through the cache and the parser pool.
+        The files are handled in chunks, cached records are reused and only
+        new or changed files are sent to the bounded work queue.
+
+        :param entries: os.DirEntry objects or paths, can be a generator
+        :param workers: The number of processes, None for all CPU cores
+        :param tail_only: Only checking the termination lines
+        :param chunk_size: The number of files in each chunk
+        :type workers: int
+        :type tail_only: bool
+        :type chunk_size: int
+        :return: Generator of (path, GaussianResult) in the order of entries
+        """
+        profile = self.profile
+        entries = iter(profile.timed(entries, 'scan'))
+        chunks = deque()
+
+        def missing_paths():
+            for chunk in iter(lambda: list(islice(entries, chunk_size)), []):
+                paths = [getattr(entry, 'path', entry) for entry in chunk]
+                stats = [os.stat(entry) if isinstance(entry, str)
+                         else entry.stat() for entry in chunk]
+                if self.cache is None:
+                    results = [None] * len(paths)
+                else:
+                    with profile.phase('cache'):
+                        results = self.cache.get_many(paths, stats, tail_only)
+                missing = [i for i, result in enumerate(results)
+                           if result is None]
+                profile.count('files', len(paths))
+                profile.count('cache_hits', len(paths) - len(missing))
+                profile.count('parsed', len(missing))
+                if not tail_only:
+                    profile.count('bytes_parsed',
+                                  sum(stats[i].st_size for i in missing))
+                chunks.append((paths, stats, results, missing))
+                yield [paths[i] for i in missing]
+
+        parse = partial(_parse_many, tail_only=tail_only, engine=self.engine)
+        parsed_chunks = parallel_imap(parse, missing_paths(), workers, 1)
+        for parsed in profile.timed(parsed_chunks, 'parse'):
+            paths, stats, results, missing = chunks.popleft()
+            for i, result in zip(missing, parsed):
+                results[i] = result
+            if self.cache is not None and missing:
+                with profile.phase('cache'):
+                    self.cache.put_many(
+                        [paths[i] for i in missing],
+                        [stats[i] for i in missing], parsed, tail_only
+                    )
+            yield from zip(paths, results)
+
+    def _out_files(self, folder):
+        """
+        Streaming the Gaussian out files of a folder, other files are
+        reported and skipped.
+
+        :param folder: The targeted folder
+        :type folder: str
+        :return: Generator of os.DirEntry
+        """
+        def skipped(entry):
+            print('Warning!\n{} is not a Gaussian out file!'.format(
+                entry.name
+            ))
+        return scan_files(folder, '.out', skipped)
 
 
 if __name__ == '__main__':